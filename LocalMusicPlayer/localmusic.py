@@ -1,71 +1,2986 @@
 import sys
 import os
+import re
+import json
+import base64
+import string
+import mmap
+import ctypes
+import time
 import random
+import bisect
+import shutil
+import hashlib
+import collections
+import multiprocessing
+import sqlite3
+import threading
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QPushButton, QLabel, QListWidget, QListWidgetItem, QSlider, 
                              QComboBox, QFileDialog, QStyle, QDialog, QLineEdit, 
-                             QRadioButton, QMessageBox)
-from PyQt6.QtCore import Qt, QUrl, QSize, QThread, pyqtSignal, QSettings
-from PyQt6.QtGui import QPixmap, QIcon
+                             QRadioButton, QMessageBox, QMenu)
+from PyQt6.QtCore import (Qt, QUrl, QSize, QThread, QObject, QTimer, QEvent, QBuffer, QIODevice,
+                          QStandardPaths, QFile, QCoreApplication, pyqtSignal, QSettings)
+from PyQt6.QtGui import QPixmap, QIcon, QImage, QPainter, QColor
 from PyQt6.QtMultimedia import QMediaPlayer, QAudioOutput
+from PyQt6.QtNetwork import QLocalServer, QLocalSocket
+from mutagen import File as MutagenFile
 from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, APIC
+from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TRCK, ID3NoHeaderError
+from mutagen.flac import Picture
+from mutagen.mp4 import MP4Cover
+
+THUMB_SIZE = 40
+COVER_SIZE = 320
+MEMORY_BUDGET_MB = 64
+ARTWORK_MAX_SIZE = 500
+ARTWORK_QUALITY = 90
+INDEXER_IDLE_MS = 4000
+INDEXER_BATCH = 25
+INTERACTION_NOTIFY_MS = 1000
+ENGINE_CONNECT_TIMEOUT_MS = 5000
+ENGINE_IDLE_CHECK_MS = 60000
+ENGINE_IDLE_EXIT_MS = 600000
+USER_INPUT_EVENTS = frozenset({QEvent.Type.MouseButtonPress, QEvent.Type.MouseMove, QEvent.Type.KeyPress,
+                               QEvent.Type.Wheel})
+HASH_CHUNK = 1 << 18
+LOUDNESS_REFERENCE = -18.0
+K_SHELF = ((1.53512485958697, -2.69169618940638, 1.19839281085285), (1.0, -1.69065929318241, 0.73248077421585))
+K_HIGHPASS = ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621))
+WAVEFORM_RATE = 8000
+WAVEFORM_WINDOW = 400
+WAVEFORM_BUCKETS = 1024
+FP_RATE = 5512
+FP_SECONDS = 120
+FP_FRAME = 2048
+FP_HOP = 256
+FP_BANDS = 33
+FP_MIN_HZ = 300
+FP_MAX_HZ = 2000
+FP_KEY_SAMPLING = 16
+FP_MAX_BUCKET = 32
+FP_MAX_BER = 0.25
+FP_MIN_OVERLAP = 0.5
+DOWNLOAD_STAGING = ".localmusic-staging"
+IMPORT_STAGING = ".localmusic-import"
+PLAYBACK_RATE_LIMIT = 512 * 1024
+PLAYBACK_WORKER_SHARE = 4
+RAMP_UP_DELAY_MS = 2000
+UNDERRUN_PROBE_MS = 500
+UNDERRUN_SLACK_MS = 250
+DOWNLOAD_TEMP_SUFFIXES = (".part", ".ytdl")
+MP3_BYTES_PER_SECOND = 192000 // 8
+PREVIEW_CACHE_SECONDS = 600
+PREVIEW_WORKERS = 8
+IMPORT_EXTENSIONS = (".mp3", ".flac", ".m4a", ".mp4", ".aac", ".alac", ".wav", ".aif", ".aiff", ".ogg", ".oga",
+                     ".opus", ".wma", ".ape", ".wv")
+IMPORT_REPORT_INTERVAL = 0.5
+TAG_FRAMES = {"title": TIT2, "artist": TPE1, "album": TALB, "track": TRCK}
+SYNC_MANIFEST = ".localmusic-sync.json"
+SYNC_SAVE_INTERVAL = 5.0
+SYNC_BITRATES = (0, 256, 192, 128, 96)
+METRICS_HOST = "127.0.0.1"
+METRICS_DEFAULT_PORT = 9464
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+EVENT_LOOP_PROBE_MS = 250
+METRICS_REPORT_MS = 15000
+HISTORY_FLUSH_SECONDS = 2.0
+HISTORY_COMPACT_EVENTS = 1000
+HISTORY_LIMIT = 200
+HISTORY_VIEWS = {"most": "Most Played", "recent": "Recently Played", "never": "Never Played"}
+IMPORT_COVER_NAMES = ("cover.jpg", "folder.jpg", "front.jpg", "cover.png", "folder.png", "front.png")
+
+def get_scaled_cover_image(data, target_width, target_height):
+    image = QImage()
+    image.loadFromData(data)
+    if image.isNull(): return None
+    return crop_scaled(image, target_width, target_height)
+
+def crop_scaled(image, target_width, target_height):
+    scaled = image.scaled(target_width, target_height, 
+                          Qt.AspectRatioMode.KeepAspectRatioByExpanding, 
+                          Qt.TransformationMode.SmoothTransformation)
+    
+    x = (scaled.width() - target_width) // 2
+    y = (scaled.height() - target_height) // 2
+    return scaled.copy(x, y, target_width, target_height)
 
 def get_scaled_cover(data, target_width, target_height):
-    pixmap = QPixmap()
-    pixmap.loadFromData(data)
-    if pixmap.isNull(): return None
+    image = get_scaled_cover_image(data, target_width, target_height)
+    if image is None: return None
+    return QPixmap.fromImage(image)
+
+def make_thumbnail(data, size=THUMB_SIZE):
+    if not data: return b""
+    image = get_scaled_cover_image(data, size, size)
+    if image is None: return b""
+    buffer = QBuffer()
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, "PNG")
+    return bytes(buffer.data())
+
+def tag_text(tags, frame_id):
+    return str(tags[frame_id]) if tags is not None and frame_id in tags else ""
+
+def index_entry(path, st):
+    try:
+        tags = ID3(path)
+    except Exception:
+        tags = None
+    cover = next((frame.data for frame in tags.getall('APIC')), None) if tags is not None else None
+    started = time.monotonic()
+    thumb = make_thumbnail(cover)
+    if cover is not None:
+        cover_seconds.observe(time.monotonic() - started, "index")
+    return (path, st.st_size, st.st_mtime, thumb, tag_text(tags, "TIT2"), tag_text(tags, "TPE1"))
+
+def make_artwork(source, target, max_size=ARTWORK_MAX_SIZE):
+    image = QImage(source)
+    if image.isNull(): return False
+    size = min(max_size, image.width(), image.height())
+    return crop_scaled(image, size, size).save(target, "JPG", ARTWORK_QUALITY)
+
+def audio_span(f, size):
+    start, end = 0, size
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b"ID3":
+        start = 10 + (header[6] << 21 | header[7] << 14 | header[8] << 7 | header[9])
+        if header[5] & 0x10:
+            start += 10
+    if size - start >= 128:
+        f.seek(size - 128)
+        if f.read(3) == b"TAG":
+            end = size - 128
+    return start, max(start, end)
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        start, end = audio_span(f, os.fstat(f.fileno()).st_size)
+        digest.update(str(end - start).encode())
+        f.seek(start)
+        if end - start <= 2 * HASH_CHUNK:
+            digest.update(f.read(end - start))
+        else:
+            digest.update(f.read(HASH_CHUNK))
+            f.seek(end - HASH_CHUNK)
+            digest.update(f.read(HASH_CHUNK))
+    return digest.hexdigest()
+
+def decode_pcm(path, rate, channels, duration=None):
+    limit = ["-t", str(duration)] if duration else []
+    return subprocess.Popen(["ffmpeg", "-v", "error", "-nostdin", "-threads", "1", "-i", path, *limit,
+                             "-map", "0:a:0", "-f", "f32le", "-ac", str(channels), "-ar", str(rate), "-"],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+def audio_format(path, max_rate=48000):
+    try:
+        info = MutagenFile(path).info
+        return min(int(info.sample_rate), max_rate), 1 if info.channels == 1 else 2
+    except Exception:
+        return max_rate, 2
+
+def k_weighting_power(n, rate):
+    import numpy as np
+    freqs = np.fft.rfftfreq(n, 1 / rate)
+    z = np.exp(-2j * np.pi * np.minimum(freqs, 24000) / 48000)
+    response = np.ones(len(freqs), dtype=complex)
+    for b, a in (K_SHELF, K_HIGHPASS):
+        response *= (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    power = np.abs(response) ** 2
+    power[1:len(power) - 1 if n % 2 == 0 else None] *= 2
+    return power / (n * n)
+
+def integrated_loudness(energies):
+    import numpy as np
+    power = energies.sum(axis=1)
+    if len(power) < 4:
+        return None
+    total = np.concatenate(([0.0], np.cumsum(power)))
+    blocks = (total[4:] - total[:-4]) / 4
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(blocks)
+    gate = loudness > -70
+    if not gate.any():
+        return -70.0
+    relative = -0.691 + 10 * np.log10(blocks[gate].mean()) - 10
+    gate &= loudness > relative
+    return float(-0.691 + 10 * np.log10(blocks[gate].mean()))
+
+def analyze_loudness(path):
+    import numpy as np
+    rate, channels = audio_format(path)
+    block = rate // 10
+    weights = k_weighting_power(block, rate)
+    frame_bytes = block * channels * 4
+    energies = []
+    peak = 0.0
+    proc = decode_pcm(path, rate, channels)
+    try:
+        while True:
+            data = proc.stdout.read(frame_bytes * 100)
+            usable = len(data) - len(data) % frame_bytes
+            if not usable:
+                break
+            frames = np.frombuffer(data, dtype=np.float32, count=usable // 4).reshape(-1, block, channels)
+            peak = max(peak, float(np.abs(frames).max()))
+            spectrum = np.fft.rfft(frames, axis=1)
+            energies.append(np.einsum("fkc,k->fc", spectrum.real ** 2 + spectrum.imag ** 2, weights))
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    if proc.returncode != 0 or not energies:
+        return None
+    lufs = integrated_loudness(np.concatenate(energies))
+    if lufs is None:
+        return None
+    return lufs, peak
+
+def loudness_gain(lufs, peak):
+    gain = 10 ** ((LOUDNESS_REFERENCE - lufs) / 20)
+    if peak > 0:
+        gain = min(gain, 1 / peak)
+    return gain
+
+def build_waveform(path, folder, digest=None):
+    import numpy as np
+    hashed = None
+    if digest is None:
+        st = os.stat(path)
+        digest = file_hash(path)
+        hashed = (st.st_size, st.st_mtime, digest)
+    target = os.path.join(folder, digest + ".peaks")
+    if os.path.exists(target):
+        return hashed, False
+    windows = []
+    proc = decode_pcm(path, WAVEFORM_RATE, 1)
+    try:
+        while True:
+            data = proc.stdout.read(WAVEFORM_WINDOW * 4 * 256)
+            samples = np.frombuffer(data, dtype=np.float32, count=len(data) // 4)
+            if not samples.size:
+                break
+            samples = np.pad(np.abs(samples), (0, -samples.size % WAVEFORM_WINDOW))
+            windows.append(samples.reshape(-1, WAVEFORM_WINDOW).max(axis=1))
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    if proc.returncode != 0 or not windows:
+        return hashed, False
+    peaks = np.concatenate(windows)
+    if len(peaks) < WAVEFORM_BUCKETS:
+        buckets = peaks[np.arange(WAVEFORM_BUCKETS) * len(peaks) // WAVEFORM_BUCKETS]
+    else:
+        edges = np.linspace(0, len(peaks), WAVEFORM_BUCKETS + 1).astype(int)
+        buckets = np.maximum.reduceat(peaks, edges[:-1])
+    scale = float(buckets.max()) or 1.0
+    levels = np.round(np.minimum(buckets / scale, 1.0) * 255).astype(np.uint8)
+    temp = f"{target}.{os.getpid()}.tmp"
+    with open(temp, "wb") as f:
+        f.write(levels.tobytes())
+    os.replace(temp, target)
+    return hashed, True
+
+def compute_fingerprint(path):
+    import numpy as np
+    digest = file_hash(path)
+    proc = decode_pcm(path, FP_RATE, 1, FP_SECONDS)
+    try:
+        data = proc.stdout.read()
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    samples = np.frombuffer(data, dtype=np.float32, count=len(data) // 4)
+    if proc.returncode != 0 or samples.size < FP_FRAME + 2 * FP_HOP:
+        return digest, None, []
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FP_FRAME)[::FP_HOP]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FP_FRAME), axis=1)) ** 2
+    bins = np.round(np.geomspace(FP_MIN_HZ, FP_MAX_HZ, FP_BANDS + 1) * FP_FRAME / FP_RATE).astype(int)
+    total = np.cumsum(spectrum, axis=1)
+    energy = total[:, bins[1:] - 1] - total[:, bins[:-1] - 1]
+    slope = energy[:, :-1] - energy[:, 1:]
+    bits = (slope[1:] - slope[:-1]) > 0
+    fp = np.ascontiguousarray(np.packbits(bits, axis=1, bitorder="little")).view("<u4").ravel()
+    terms = np.unique(fp[(fp != 0) & (fp != 0xFFFFFFFF)])
+    mixed = (terms.astype(np.uint64) * 2654435761) & 0xFFFFFFFF
+    sampled = terms[mixed < (1 << 32) // FP_KEY_SAMPLING]
+    return digest, fp.tobytes(), [int(term) for term in sampled]
+
+def fingerprint_distance(first, second):
+    import numpy as np
+    a = np.frombuffer(first, dtype="<u4")
+    b = np.frombuffer(second, dtype="<u4")
+    if not a.size or not b.size:
+        return 1.0
+    common, ia, ib = np.intersect1d(a, b, assume_unique=False, return_indices=True)
+    keep = common != 0
+    if not keep.any():
+        return 1.0
+    offsets, counts = np.unique(ia[keep].astype(int) - ib[keep].astype(int), return_counts=True)
+    offset = int(offsets[counts.argmax()])
+    start, end = max(0, offset), min(len(a), len(b) + offset)
+    if end - start < min(len(a), len(b)) * FP_MIN_OVERLAP:
+        return 1.0
+    diff = a[start:end] ^ b[start - offset:end - offset]
+    return float(np.unpackbits(diff.view(np.uint8)).sum()) / (32 * (end - start))
+
+def read_source_cover(path):
+    audio = MutagenFile(path)
+    tags = audio.tags if audio is not None else None
+    if getattr(audio, "pictures", None):
+        return audio.pictures[0].data, audio.pictures[0].mime
+    if tags is not None and hasattr(tags, "getall"):
+        for frame in tags.getall("APIC"):
+            return frame.data, frame.mime
+    if tags is not None and "covr" in tags:
+        cover = tags["covr"][0]
+        return bytes(cover), "image/png" if cover.imageformat == MP4Cover.FORMAT_PNG else "image/jpeg"
+    if tags is not None and "metadata_block_picture" in tags:
+        picture = Picture(base64.b64decode(tags["metadata_block_picture"][0]))
+        return picture.data, picture.mime
+    folder = os.path.dirname(path)
+    for name in IMPORT_COVER_NAMES:
+        cover_path = os.path.join(folder, name)
+        if os.path.exists(cover_path):
+            with open(cover_path, "rb") as f:
+                return f.read(), "image/png" if name.endswith(".png") else "image/jpeg"
+    return None
+
+def import_track(source, target, staging):
+    temp_path = os.path.join(staging, os.path.basename(target))
+    try:
+        if source.lower().endswith(".mp3"):
+            shutil.copyfile(source, temp_path)
+        else:
+            subprocess.run(["ffmpeg", "-v", "error", "-nostdin", "-y", "-i", source, "-map", "0:a:0",
+                            "-map_metadata", "0", "-c:a", "libmp3lame", "-q:a", "2", "-id3v2_version", "3",
+                            "-f", "mp3", temp_path],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            try:
+                cover = read_source_cover(source)
+            except Exception:
+                cover = None
+            if cover:
+                audio = MP3(temp_path)
+                if audio.tags is None:
+                    audio.add_tags()
+                audio.tags.add(APIC(encoding=3, mime=cover[1], type=3, desc="Cover", data=cover[0]))
+                audio.save(v2_version=3)
+        os.replace(temp_path, target)
+    except Exception:
+        try: os.remove(temp_path)
+        except OSError: pass
+        raise
+    return os.path.getsize(source)
+
+def sync_track(source, target, bitrate=0):
+    temp_path = target + ".part"
+    try:
+        if bitrate:
+            subprocess.run(["ffmpeg", "-v", "error", "-nostdin", "-y", "-i", source, "-map", "0:a:0", "-map", "0:v?",
+                            "-c:v", "copy", "-map_metadata", "0", "-c:a", "libmp3lame", "-b:a", f"{int(bitrate)}k",
+                            "-id3v2_version", "3", "-f", "mp3", temp_path],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        else:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+    except Exception:
+        try: os.remove(temp_path)
+        except OSError: pass
+        raise
+    return os.path.getsize(source)
+
+def compile_tag_pattern(pattern):
+    regex = ""
+    seen = set()
+    for literal, field, _, _ in string.Formatter().parse(pattern):
+        regex += re.escape(literal)
+        if field is not None:
+            if field not in TAG_FRAMES:
+                raise ValueError(f"Unknown field in pattern: {field}")
+            if field in seen:
+                raise ValueError(f"Field used twice in pattern: {field}")
+            seen.add(field)
+            regex += f"(?P<{field}>.+?)"
+    try:
+        return re.compile(regex)
+    except re.error as e:
+        raise ValueError(f"Invalid pattern: {e}")
+
+def parse_tag_pattern(regex, path):
+    match = regex.fullmatch(os.path.splitext(os.path.basename(path))[0])
+    return {field: value.strip() for field, value in match.groupdict().items()} if match else {}
+
+def edit_tags(path, values, find="", replace="", fields=()):
+    st = os.stat(path)
+    try:
+        tags = ID3(path)
+        version = 4 if tags.version >= (2, 4, 0) else 3
+    except ID3NoHeaderError:
+        tags = ID3()
+        version = 3
+    changed = False
+    for field, value in values.items():
+        frame = TAG_FRAMES[field]
+        if value and tag_text(tags, frame.__name__) != value:
+            tags.setall(frame.__name__, [frame(encoding=3, text=value)])
+            changed = True
+    if find:
+        for field in fields:
+            frame = TAG_FRAMES[field]
+            old = tag_text(tags, frame.__name__)
+            new = old.replace(find, replace)
+            if new != old:
+                tags.setall(frame.__name__, [frame(encoding=3, text=new)])
+                changed = True
+    in_place = True
+    if changed:
+        def keep_padding(info):
+            nonlocal in_place
+            if info.padding >= 0:
+                return info.padding
+            in_place = False
+            return info.get_default_padding()
+        tags.save(path, v2_version=version, padding=keep_padding)
+        st = os.stat(path)
+    return (path, st.st_size, st.st_mtime, tag_text(tags, "TIT2"), tag_text(tags, "TPE1"), changed, in_place)
+
+def worker_pool(max_workers=None):
+    return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                               mp_context=multiprocessing.get_context("spawn"),
+                               initializer=lower_thread_priority)
+
+shared_pool_lock = threading.Lock()
+shared_pool_executor = None
+
+def shared_pool():
+    global shared_pool_executor
+    with shared_pool_lock:
+        if shared_pool_executor is None:
+            shared_pool_executor = worker_pool()
+        return shared_pool_executor
+
+class BackgroundGate:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def set_limit(self, limit):
+        with self.condition:
+            self.limit = max(1, limit)
+            self.condition.notify_all()
+
+    def submit(self, func, *args):
+        with self.condition:
+            while self.in_use >= self.limit:
+                self.condition.wait()
+            self.in_use += 1
+        try:
+            future = shared_pool().submit(func, *args)
+        except Exception:
+            self.release()
+            raise
+        future.add_done_callback(self.release)
+        return future
+
+    def release(self, future=None):
+        with self.condition:
+            self.in_use -= 1
+            self.condition.notify_all()
+
+background_gate = BackgroundGate(os.cpu_count() or 1)
+
+def release_heap():
+    if sys.platform.startswith("linux"):
+        try:
+            ctypes.CDLL("libc.so.6").malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+class MemoryBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.caches = []
+        self.clock = 0.0
+        self.lock = threading.RLock()
+
+    def register(self, cache):
+        with self.lock:
+            self.caches.append(cache)
+
+    def total(self):
+        with self.lock:
+            return sum(cache.bytes for cache in self.caches)
+
+    def set_limit(self, limit):
+        self.limit = limit
+        self.enforce()
+
+    def enforce(self, limit=None):
+        limit = self.limit if limit is None else limit
+        with self.lock:
+            total = self.total()
+            while total > limit:
+                candidates = [(cache.cheapest(), cache) for cache in self.caches if cache.entries]
+                if not candidates:
+                    break
+                (key, priority), cache = min(candidates, key=lambda c: c[0][1])
+                self.clock = priority
+                total -= cache.evict(key)
+
+    def trim(self, fraction=0.0):
+        self.enforce(int(self.total() * fraction))
+        release_heap()
+
+    def report(self):
+        with self.lock:
+            return {"limit": self.limit, "total": self.total(),
+                    "caches": {cache.name: cache.stats() for cache in self.caches}}
+
+memory_budget = MemoryBudget(MEMORY_BUDGET_MB << 20)
+
+class BudgetCache:
+    def __init__(self, name, budget=memory_budget):
+        self.name = name
+        self.budget = budget
+        self.entries = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        budget.register(self)
+
+    def get(self, key):
+        with self.budget.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry[3] = self.budget.clock + entry[2] / entry[1]
+            return entry[0]
+
+    def put(self, key, value, size, cost):
+        size = max(1, int(size))
+        with self.budget.lock:
+            self.pop(key)
+            self.entries[key] = [value, size, cost, self.budget.clock + cost / size]
+            self.bytes += size
+        self.budget.enforce()
+
+    def pop(self, key):
+        with self.budget.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return 0
+            self.bytes -= entry[1]
+            return entry[1]
+
+    def evict(self, key):
+        self.evictions += 1
+        return self.pop(key)
+
+    def cheapest(self):
+        key, entry = min(self.entries.items(), key=lambda item: item[1][3])
+        return key, entry[3]
+
+    def clear(self):
+        with self.budget.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+def format_memory_report(report):
+    lines = [f"{report['total'] / (1 << 20):.1f} MB of {report['limit'] / (1 << 20):.0f} MB"]
+    for name, stats in report["caches"].items():
+        lines.append(f"{name}: {stats['entries']} entries, {stats['bytes'] / (1 << 20):.1f} MB "
+                     f"(hits {stats['hits']}, misses {stats['misses']}, evicted {stats['evictions']})")
+    return "\n".join(lines)
+
+def list_size(items):
+    return sys.getsizeof(items) + sum(sys.getsizeof(item) for item in items)
+
+def format_labels(names, values, extra=()):
+    parts = []
+    for name, value in list(zip(names, values)) + list(extra):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Metric:
+    def __init__(self, kind, name, help, labels=()):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def render(self):
+        with self.lock:
+            return [f"{self.name}{format_labels(self.labels, labels)} {value}"
+                    for labels, value in sorted(self.values.items())]
+
+class Histogram(Metric):
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__("histogram", name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Metric("counter", name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.add(Metric("gauge", name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def on_collect(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception:
+                pass
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+scan_seconds = metrics.histogram("localmusic_scan_seconds", "Time spent listing a library folder.", ("kind",))
+scan_failures = metrics.counter("localmusic_scan_failures_total", "Library roots that could not be listed.")
+indexed_tracks = metrics.counter("localmusic_indexed_tracks_total", "Tracks whose tags and thumbnail were read.")
+cover_seconds = metrics.histogram("localmusic_cover_seconds", "Time spent extracting and scaling cover art.",
+                                  ("source",))
+cache_hits = metrics.counter("localmusic_cache_hits_total", "Cache lookups that found an entry.", ("cache",))
+cache_misses = metrics.counter("localmusic_cache_misses_total", "Cache lookups that found nothing.", ("cache",))
+cache_evictions = metrics.counter("localmusic_cache_evictions_total", "Entries evicted by the memory budget.",
+                                  ("cache",))
+cache_bytes = metrics.gauge("localmusic_cache_bytes", "Estimated size of each cache.", ("cache",))
+memory_budget_bytes = metrics.gauge("localmusic_memory_budget_bytes", "Memory budget shared by the caches.")
+track_start_seconds = metrics.histogram("localmusic_track_start_seconds",
+                                        "Time from a play request until the track is loaded.")
+tracks_started = metrics.counter("localmusic_tracks_started_total", "Tracks started.")
+playback_errors = metrics.counter("localmusic_playback_errors_total", "Errors reported by the media player.")
+playback_underruns = metrics.counter("localmusic_playback_underruns_total", "Playback stalls, by throttling mode.",
+                                     ("mode",))
+downloads_total = metrics.counter("localmusic_downloads_total", "Finished download jobs, by result.", ("result",))
+download_seconds = metrics.histogram("localmusic_download_seconds", "Duration of download jobs.", ("result",))
+downloaded_files = metrics.counter("localmusic_downloaded_files_total", "Tracks published by downloads.")
+downloads_queued = metrics.gauge("localmusic_downloads_queued", "Download jobs waiting or running.")
+event_loop_lag_seconds = metrics.histogram("localmusic_event_loop_lag_seconds",
+                                           "Delay of the engine event loop behind its timers.")
+
+def collect_cache_metrics():
+    report = memory_budget.report()
+    memory_budget_bytes.set(report["limit"])
+    for name, stats in report["caches"].items():
+        cache_hits.set(stats["hits"], name)
+        cache_misses.set(stats["misses"], name)
+        cache_evictions.set(stats["evictions"], name)
+        cache_bytes.set(stats["bytes"], name)
+
+metrics.on_collect(collect_cache_metrics)
+
+class MetricsServer:
+    def __init__(self, registry=metrics):
+        self.registry = registry
+        self.httpd = None
+
+    def start(self, port):
+        self.stop()
+        registry = self.registry
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((METRICS_HOST, port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.httpd.server_address[1]
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def port(self):
+        return self.httpd.server_address[1] if self.httpd is not None else 0
+
+def app_cache_dir():
+    base = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.GenericCacheLocation)
+    path = os.path.join(base, "LocalMusicPlayer")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def lower_thread_priority():
+    if not sys.platform.startswith("linux"):
+        return
+    tid = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+    except Exception:
+        pass
+    if shutil.which("ionice"):
+        try:
+            subprocess.run(["ionice", "-c", "3", "-p", str(tid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5)
+        except Exception:
+            pass
+
+class LibraryIndex:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(app_cache_dir(), "library.db")
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS tracks (path TEXT PRIMARY KEY, folder TEXT, "
+                        "size INTEGER, mtime REAL, thumb BLOB)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS tracks_folder ON tracks (folder)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS tracks_mtime ON tracks (mtime)")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(tracks)")}
+        for column, kind in (("title", "TEXT"), ("artist", "TEXT"), ("added", "REAL")):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE tracks ADD COLUMN {column} {kind}")
+        self.db.execute("UPDATE tracks SET added = mtime WHERE added IS NULL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER, "
+                        "mtime REAL, hash TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS loudness (hash TEXT PRIMARY KEY, lufs REAL, peak REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS fingerprints (id INTEGER PRIMARY KEY, hash TEXT UNIQUE, fp BLOB)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS fingerprint_keys (key INTEGER, track INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS fingerprint_keys_key ON fingerprint_keys (key)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS imports (hash TEXT, playlist TEXT, target TEXT, "
+                        "PRIMARY KEY (hash, playlist))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS plays (path TEXT PRIMARY KEY, completed INTEGER, "
+                        "skipped INTEGER, last_played REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS plays_completed ON plays (completed, last_played)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS plays_last_played ON plays (last_played)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self.db.commit()
+
+    def cached_hash(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT size, mtime, hash FROM hashes WHERE path = ?", (path,)).fetchone()
+        return row[2] if is_fresh(row, st) else None
+
+    def content_hash(self, path):
+        digest = self.cached_hash(path)
+        if digest is not None:
+            return digest
+        st = os.stat(path)
+        digest = file_hash(path)
+        self.store_hash(path, st.st_size, st.st_mtime, digest)
+        return digest
+
+    def store_hash(self, path, size, mtime, digest):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO hashes (path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+                            (path, size, mtime, digest))
+            self.db.commit()
+
+    def loudness(self, digest):
+        with self.lock:
+            return self.db.execute("SELECT lufs, peak FROM loudness WHERE hash = ?", (digest,)).fetchone()
+
+    def store_loudness(self, digest, lufs, peak):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO loudness (hash, lufs, peak) VALUES (?, ?, ?)",
+                            (digest, lufs, peak))
+            self.db.commit()
+
+    def fingerprint(self, digest):
+        with self.lock:
+            row = self.db.execute("SELECT fp FROM fingerprints WHERE hash = ?", (digest,)).fetchone()
+        return None if row is None else row[0]
+
+    def store_fingerprint(self, digest, fp, keys):
+        with self.lock:
+            row = self.db.execute("SELECT id FROM fingerprints WHERE hash = ?", (digest,)).fetchone()
+            if row is None:
+                track = self.db.execute("INSERT INTO fingerprints (hash, fp) VALUES (?, ?)", (digest, fp)).lastrowid
+            else:
+                track = row[0]
+                self.db.execute("UPDATE fingerprints SET fp = ? WHERE id = ?", (fp, track))
+                self.db.execute("DELETE FROM fingerprint_keys WHERE track = ?", (track,))
+            self.db.executemany("INSERT INTO fingerprint_keys (key, track) VALUES (?, ?)",
+                                [(key, track) for key in keys])
+            self.db.commit()
+
+    def fingerprint_candidates(self):
+        with self.lock:
+            return self.db.execute(
+                "SELECT DISTINCT fa.hash, fb.hash FROM fingerprint_keys a "
+                "JOIN fingerprint_keys b ON a.key = b.key AND a.track < b.track "
+                "JOIN fingerprints fa ON fa.id = a.track JOIN fingerprints fb ON fb.id = b.track "
+                "WHERE a.key IN (SELECT key FROM fingerprint_keys GROUP BY key "
+                "HAVING COUNT(*) BETWEEN 2 AND ?)", (FP_MAX_BUCKET,)).fetchall()
+
+    def imported(self, digest, playlist):
+        with self.lock:
+            row = self.db.execute("SELECT target FROM imports WHERE hash = ? AND playlist = ?",
+                                  (digest, playlist)).fetchone()
+        return None if row is None else row[0]
+
+    def store_import(self, digest, playlist, target):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO imports (hash, playlist, target) VALUES (?, ?, ?)",
+                            (digest, playlist, target))
+            self.db.commit()
+
+    def folded_segment(self):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'history_segment'").fetchone()
+        return row[0] if row else 0
+
+    def fold_plays(self, events, segment):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'history_segment'").fetchone()
+            if row and row[0] >= segment:
+                return 0
+            totals = {}
+            for started, completed, path in events:
+                total = totals.setdefault(path, [0, 0, started])
+                total[0 if completed else 1] += 1
+                total[2] = max(total[2], started)
+            self.db.executemany("INSERT INTO plays (path, completed, skipped, last_played) VALUES (?, ?, ?, ?) "
+                                "ON CONFLICT (path) DO UPDATE SET completed = completed + excluded.completed, "
+                                "skipped = skipped + excluded.skipped, "
+                                "last_played = MAX(last_played, excluded.last_played)",
+                                [(path, *total) for path, total in totals.items()])
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('history_segment', ?)", (segment,))
+            self.db.commit()
+            return sum(total[0] + total[1] for total in totals.values())
+
+    def play_history(self, view, folders, limit=HISTORY_LIMIT):
+        marks = ",".join("?" * len(folders))
+        if view == "most":
+            query = (f"SELECT p.path, p.completed, p.skipped, p.last_played FROM plays p "
+                     f"CROSS JOIN tracks t ON t.path = p.path WHERE p.completed > 0 AND t.folder IN ({marks}) "
+                     f"ORDER BY p.completed DESC, p.last_played DESC LIMIT ?")
+        elif view == "recent":
+            query = (f"SELECT p.path, p.completed, p.skipped, p.last_played FROM plays p "
+                     f"CROSS JOIN tracks t ON t.path = p.path WHERE t.folder IN ({marks}) "
+                     f"ORDER BY p.last_played DESC LIMIT ?")
+        elif view == "never":
+            query = (f"SELECT t.path, 0, COALESCE(p.skipped, 0), p.last_played FROM tracks t INDEXED BY tracks_mtime "
+                     f"LEFT JOIN plays p ON p.path = t.path WHERE COALESCE(p.completed, 0) = 0 "
+                     f"AND t.folder IN ({marks}) ORDER BY t.mtime DESC LIMIT ?")
+        else:
+            raise ValueError(f"Unknown history view: {view}")
+        with self.lock:
+            return [list(row) for row in self.db.execute(query, (*folders, limit)).fetchall()]
+
+    def track_gain(self, digest):
+        row = self.loudness(digest)
+        return loudness_gain(*row) if row else None
+
+    def track_names(self):
+        with self.lock:
+            rows = self.db.execute("SELECT path FROM tracks").fetchall()
+        return {os.path.basename(row[0]).lower() for row in rows}
+
+    def folder_entries(self, folder):
+        with self.lock:
+            rows = self.db.execute("SELECT path, size, mtime, thumb, title, artist, added FROM tracks "
+                                   "WHERE folder = ?", (folder,)).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def store_many(self, rows):
+        with self.lock:
+            self.db.executemany("INSERT INTO tracks (path, folder, size, mtime, thumb, title, artist, added) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET "
+                                "folder = excluded.folder, size = excluded.size, mtime = excluded.mtime, "
+                                "thumb = excluded.thumb, title = excluded.title, artist = excluded.artist",
+                                [(p, os.path.dirname(p), size, mtime, thumb, title, artist, mtime)
+                                 for p, size, mtime, thumb, title, artist in rows])
+            self.db.commit()
+
+    def update_tags(self, rows):
+        with self.lock:
+            self.db.executemany("UPDATE tracks SET size = ?, mtime = ?, title = ?, artist = ? WHERE path = ?",
+                                [(size, mtime, title, artist, p) for p, size, mtime, title, artist in rows])
+            self.db.executemany("UPDATE hashes SET size = ?, mtime = ? WHERE path = ?",
+                                [(size, mtime, p) for p, size, mtime, title, artist in rows])
+            self.db.commit()
+
+    def prune(self, folder, keep):
+        stale = [p for p in self.folder_entries(folder) if p not in keep]
+        if not stale: return
+        with self.lock:
+            self.db.executemany("DELETE FROM tracks WHERE path = ?", [(p,) for p in stale])
+            self.db.commit()
+
+def is_fresh(entry, st):
+    return entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime
+
+def is_indexed(entry, st):
+    return is_fresh(entry, st) and entry[3] is not None
+
+def play_history_path():
+    return os.path.join(app_cache_dir(), "history.log")
+
+class PlayHistory:
+    def __init__(self, index, path=None):
+        self.index = index
+        self.path = path or play_history_path()
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.log_lock = threading.Lock()
+        self.logged = 0
+        self.wakeup = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def record(self, path, started, completed):
+        with self.pending_lock:
+            self.pending.append(f"{started:.3f}\t{'completed' if completed else 'skipped'}\t{path}\n")
+        self.wakeup.set()
+
+    def run(self):
+        self.compact()
+        while True:
+            self.wakeup.wait()
+            time.sleep(HISTORY_FLUSH_SECONDS)
+            self.wakeup.clear()
+            self.flush()
+            if self.logged >= HISTORY_COMPACT_EVENTS:
+                self.compact()
+
+    def flush(self):
+        with self.log_lock:
+            with self.pending_lock:
+                lines, self.pending = self.pending, []
+            if not lines:
+                return
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+                self.logged += len(lines)
+            except OSError:
+                with self.pending_lock:
+                    self.pending[:0] = lines
+
+    def segments(self):
+        prefix = os.path.basename(self.path) + "."
+        try:
+            names = os.listdir(os.path.dirname(self.path))
+        except OSError:
+            return []
+        return sorted(int(name[len(prefix):]) for name in names
+                      if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+    def read_segment(self, segment):
+        try:
+            with open(f"{self.path}.{segment}", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return None
+        events = []
+        for line in lines:
+            started, _, rest = line.rstrip("\n").partition("\t")
+            outcome, _, path = rest.partition("\t")
+            if not path:
+                continue
+            try:
+                events.append((float(started), outcome == "completed", path))
+            except ValueError:
+                continue
+        return events
+
+    def compact(self):
+        with self.log_lock:
+            segments = self.segments()
+            if os.path.exists(self.path):
+                segment = max([self.index.folded_segment(), *segments]) + 1
+                try:
+                    os.replace(self.path, f"{self.path}.{segment}")
+                    segments.append(segment)
+                except OSError:
+                    pass
+            self.logged = 0
+            folded = 0
+            for segment in segments:
+                events = self.read_segment(segment)
+                if events is None:
+                    continue
+                folded += self.index.fold_plays(events, segment)
+                try:
+                    os.remove(f"{self.path}.{segment}")
+                except OSError:
+                    pass
+            return folded
+
+    def query(self, view, folders, limit=HISTORY_LIMIT):
+        self.flush()
+        self.compact()
+        return self.index.play_history(view, folders, limit)
+
+def expand_tracks(paths):
+    tracks = []
+    for path in paths:
+        if os.path.isdir(path):
+            try:
+                tracks.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.lower().endswith(".mp3"))
+            except OSError:
+                pass
+        else:
+            tracks.append(path)
+    return tracks
+
+class LoudnessAnalyzer(QObject):
+    analyzed = pyqtSignal(str, float)
+    progress = pyqtSignal(int, int, float)
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        self.running = 0
+
+    def analyze(self, paths):
+        self.running += 1
+        threading.Thread(target=self.run, args=(list(paths),), daemon=True).start()
+
+    def run(self, paths):
+        lower_thread_priority()
+        try:
+            self.analyze_tracks(paths)
+        finally:
+            self.running -= 1
+
+    def analyze_tracks(self, paths):
+        started = time.monotonic()
+        jobs = {}
+        for path in expand_tracks(paths):
+            try:
+                digest = self.index.content_hash(path)
+            except OSError:
+                continue
+            if self.index.loudness(digest) is None:
+                jobs[path] = digest
+        if not jobs:
+            return
+        futures = {background_gate.submit(analyze_loudness, path): path for path in jobs}
+        done = 0
+        for future in as_completed(futures):
+            path = futures[future]
+            done += 1
+            try:
+                result = future.result()
+            except Exception:
+                result = None
+            if result:
+                self.index.store_loudness(jobs[path], *result)
+                self.analyzed.emit(path, loudness_gain(*result))
+            self.progress.emit(done, len(jobs), time.monotonic() - started)
+
+class DuplicateFinder(QObject):
+    progress = pyqtSignal(int, int)
+    found = pyqtSignal(list)
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        self.running = 0
+
+    def find(self, paths):
+        self.running += 1
+        threading.Thread(target=self.run, args=(list(paths),), daemon=True).start()
+
+    def run(self, paths):
+        lower_thread_priority()
+        try:
+            self.find_groups(paths)
+        finally:
+            self.running -= 1
+
+    def find_groups(self, paths):
+        by_hash = collections.defaultdict(list)
+        for path in expand_tracks(paths):
+            try:
+                by_hash[self.index.content_hash(path)].append(path)
+            except OSError:
+                pass
+        missing = [group[0] for digest, group in by_hash.items() if self.index.fingerprint(digest) is None]
+        futures = [background_gate.submit(compute_fingerprint, path) for path in missing]
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                digest, fp, keys = future.result()
+            except Exception:
+                continue
+            if fp is not None:
+                self.index.store_fingerprint(digest, fp, keys)
+            self.progress.emit(done, len(futures))
+        parent = {digest: digest for digest in by_hash}
+        def root(digest):
+            while parent[digest] != digest:
+                parent[digest] = parent[parent[digest]]
+                digest = parent[digest]
+            return digest
+        for a, b in self.index.fingerprint_candidates():
+            if a not in parent or b not in parent or root(a) == root(b):
+                continue
+            first, second = self.index.fingerprint(a), self.index.fingerprint(b)
+            if first and second and fingerprint_distance(first, second) <= FP_MAX_BER:
+                parent[root(b)] = root(a)
+        groups = collections.defaultdict(list)
+        for digest, group in by_hash.items():
+            groups[root(digest)].extend(group)
+        result = []
+        for group in groups.values():
+            if len(group) > 1:
+                result.append(sorted(group, key=lambda p: -os.path.getsize(p) if os.path.exists(p) else 0))
+        self.found.emit(result)
+
+def collect_imports(source, playlist):
+    skip = os.path.abspath(playlist)
+    for folder, dirs, files in os.walk(source):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(folder, d)) != skip)
+        for name in sorted(files):
+            if name.lower().endswith(IMPORT_EXTENSIONS):
+                yield os.path.join(folder, name)
+
+def unique_target(playlist, path, taken):
+    base = os.path.splitext(os.path.basename(path))[0]
+    name = base + ".mp3"
+    number = 2
+    while name.lower() in taken:
+        name = f"{base} ({number}).mp3"
+        number += 1
+    taken.add(name.lower())
+    return os.path.join(playlist, name)
+
+class BulkImporter(QObject):
+    progress = pyqtSignal(int, int, float, float)
+    finished = pyqtSignal(str, list, int, int)
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        self.running = 0
+
+    def start(self, source, playlist):
+        self.running += 1
+        threading.Thread(target=self.run, args=(source, playlist), daemon=True).start()
+
+    def run(self, source, playlist):
+        lower_thread_priority()
+        try:
+            self.import_tree(source, playlist)
+        finally:
+            self.running -= 1
+
+    def import_tree(self, source, playlist):
+        started = time.monotonic()
+        sources = list(collect_imports(source, playlist))
+        taken = {name.lower() for name in os.listdir(playlist)}
+        base = os.path.join(playlist, IMPORT_STAGING)
+        os.makedirs(base, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=base)
+        try:
+            self.import_files(sources, playlist, taken, staging, started)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+            try: os.rmdir(base)
+            except OSError: pass
+
+    def import_files(self, sources, playlist, taken, staging, started):
+        condition = threading.Condition()
+        imported = []
+        counts = {"done": 0, "imported": 0, "skipped": 0, "failed": 0, "bytes": 0, "reported": 0.0}
+
+        def finish(size=0, target=None, result="imported"):
+            with condition:
+                counts["done"] += 1
+                counts[result] += 1
+                counts["bytes"] += size
+                if target:
+                    imported.append(target)
+                now = time.monotonic()
+                if counts["done"] == len(sources) or now - counts["reported"] >= IMPORT_REPORT_INTERVAL:
+                    counts["reported"] = now
+                    self.progress.emit(counts["done"], len(sources), now - started, counts["bytes"])
+                condition.notify_all()
+
+        def on_done(future, digest, target):
+            try:
+                size = future.result()
+            except Exception:
+                finish(result="failed")
+                return
+            self.index.store_import(digest, playlist, target)
+            finish(size, target)
+
+        for path in sources:
+            try:
+                digest = self.index.content_hash(path)
+            except OSError:
+                finish(result="failed")
+                continue
+            previous = self.index.imported(digest, playlist)
+            if previous and os.path.exists(previous):
+                finish(result="skipped")
+                continue
+            target = unique_target(playlist, path, taken)
+            try:
+                future = background_gate.submit(import_track, path, target, staging)
+            except Exception:
+                finish(result="failed")
+                continue
+            future.add_done_callback(lambda f, d=digest, t=target: on_done(f, d, t))
+        with condition:
+            condition.wait_for(lambda: counts["done"] == len(sources))
+        self.finished.emit(playlist, sorted(imported), counts["skipped"], counts["failed"])
+
+def duplicate_names(playlists):
+    names = collections.Counter(os.path.basename(p) for p in playlists)
+    return sorted(name for name, count in names.items() if count > 1)
+
+class DeviceSync(QObject):
+    progress = pyqtSignal(int, int, float, float)
+    finished = pyqtSignal(str, dict, float)
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        self.running = 0
+
+    def start(self, playlists, target, bitrate=0):
+        self.running += 1
+        threading.Thread(target=self.run, args=(list(playlists), target, bitrate), daemon=True).start()
+
+    def run(self, playlists, target, bitrate):
+        lower_thread_priority()
+        try:
+            self.sync(playlists, target, bitrate)
+        finally:
+            self.running -= 1
+
+    def sync(self, playlists, target, bitrate):
+        started = time.monotonic()
+        manifest_path = os.path.join(target, SYNC_MANIFEST)
+        manifest = read_json(manifest_path, {})
+        counts = {"copied": 0, "moved": 0, "removed": 0, "unchanged": 0, "failed": 0}
+
+        wanted = {}
+        unreadable = set()
+        for playlist in playlists:
+            try:
+                tracks, stats = scan_playlist(playlist)
+            except OSError:
+                unreadable.add(os.path.basename(playlist))
+                counts["failed"] += 1
+                continue
+            for path, st in zip(tracks, stats):
+                wanted[os.path.join(os.path.basename(playlist), os.path.basename(path))] = (path, st)
+
+        listings = {}
+        def on_device(rel):
+            folder = os.path.dirname(rel)
+            if folder not in listings:
+                try:
+                    listings[folder] = set(os.listdir(os.path.join(target, folder)))
+                except OSError:
+                    listings[folder] = set()
+            return os.path.basename(rel) in listings[folder]
+
+        stale = {rel: entry for rel, entry in manifest.items()
+                 if rel not in wanted and os.path.dirname(rel) not in unreadable}
+        moved_from = {entry["hash"]: rel for rel, entry in stale.items()}
+        jobs = []
+        for rel, (path, st) in wanted.items():
+            entry = manifest.get(rel)
+            if (entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime
+                    and entry["bitrate"] == bitrate and on_device(rel)):
+                counts["unchanged"] += 1
+                continue
+            try:
+                digest = self.index.content_hash(path)
+            except OSError:
+                counts["failed"] += 1
+                continue
+            record = {"size": st.st_size, "mtime": st.st_mtime, "hash": digest, "bitrate": bitrate}
+            old = moved_from.pop(digest, None)
+            if old is not None and entry is None and manifest[old] == record:
+                try:
+                    os.makedirs(os.path.join(target, os.path.dirname(rel)), exist_ok=True)
+                    os.replace(os.path.join(target, old), os.path.join(target, rel))
+                except OSError:
+                    pass
+                else:
+                    manifest[rel] = record
+                    del manifest[old], stale[old]
+                    counts["moved"] += 1
+                    continue
+            jobs.append((rel, path, record))
+
+        for rel in stale:
+            try: os.remove(os.path.join(target, rel))
+            except OSError: pass
+            del manifest[rel]
+            counts["removed"] += 1
+        for folder in {os.path.dirname(rel) for rel in stale}:
+            try: os.rmdir(os.path.join(target, folder))
+            except OSError: pass
+
+        condition = threading.Condition()
+        state = {"done": 0, "bytes": 0, "saved": time.monotonic()}
+        def finish(rel=None, record=None, size=0):
+            with condition:
+                state["done"] += 1
+                state["bytes"] += size
+                if record is None:
+                    counts["failed"] += 1
+                else:
+                    manifest[rel] = record
+                    counts["copied"] += 1
+                now = time.monotonic()
+                if state["done"] == len(jobs) or now - state["saved"] >= SYNC_SAVE_INTERVAL:
+                    state["saved"] = now
+                    write_json(manifest_path, manifest)
+                    self.progress.emit(state["done"], len(jobs), now - started, state["bytes"])
+                condition.notify_all()
+
+        def on_done(future, rel, record):
+            try:
+                size = future.result()
+            except Exception:
+                finish()
+                return
+            finish(rel, record, size)
+
+        write_json(manifest_path, manifest)
+        for rel, path, record in jobs:
+            try:
+                os.makedirs(os.path.join(target, os.path.dirname(rel)), exist_ok=True)
+                future = background_gate.submit(sync_track, path, os.path.join(target, rel), bitrate)
+            except Exception:
+                finish()
+                continue
+            future.add_done_callback(lambda f, r=rel, rec=record: on_done(f, r, rec))
+        with condition:
+            condition.wait_for(lambda: state["done"] == len(jobs))
+        self.finished.emit(target, counts, time.monotonic() - started)
+
+class TagEditor(QObject):
+    progress = pyqtSignal(int, int)
+    updated = pyqtSignal(list)
+    finished = pyqtSignal(dict)
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        self.running = 0
+
+    def start(self, paths, pattern="", find="", replace="", fields=()):
+        regex = compile_tag_pattern(pattern) if pattern else None
+        self.running += 1
+        threading.Thread(target=self.run, args=(list(paths), regex, find, replace, tuple(fields)), daemon=True).start()
+
+    def run(self, paths, regex, find, replace, fields):
+        lower_thread_priority()
+        try:
+            self.edit(paths, regex, find, replace, fields)
+        finally:
+            self.running -= 1
+
+    def edit(self, paths, regex, find, replace, fields):
+        counts = {"changed": 0, "in_place": 0, "unchanged": 0, "failed": 0}
+        futures = []
+        for path in paths:
+            values = parse_tag_pattern(regex, path) if regex else {}
+            if not values and not find:
+                counts["unchanged"] += 1
+                continue
+            futures.append(background_gate.submit(edit_tags, path, values, find, replace, fields))
+        rows = []
+        reported = time.monotonic()
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                path, size, mtime, title, artist, changed, in_place = future.result()
+            except Exception:
+                counts["failed"] += 1
+                continue
+            if not changed:
+                counts["unchanged"] += 1
+                continue
+            counts["changed"] += 1
+            counts["in_place"] += in_place
+            rows.append((path, size, mtime, title, artist))
+            if done == len(futures) or time.monotonic() - reported >= IMPORT_REPORT_INTERVAL:
+                self.flush(rows)
+                rows = []
+                reported = time.monotonic()
+                self.progress.emit(done, len(futures))
+        self.flush(rows)
+        self.finished.emit(counts)
+
+    def flush(self, rows):
+        if rows:
+            self.index.update_tags(rows)
+            self.updated.emit([[path, title, artist] for path, size, mtime, title, artist in rows])
+
+def waveform_dir():
+    path = os.path.join(app_cache_dir(), "waveforms")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def load_peaks(index, path):
+    try:
+        digest = index.cached_hash(path)
+        if digest is None:
+            return None
+        with open(os.path.join(waveform_dir(), digest + ".peaks"), "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, sqlite3.Error):
+        return None
+
+class WaveformCache(QObject):
+    ready = pyqtSignal(str)
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        self.folder = waveform_dir()
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.queued = set()
+        self.in_flight = 0
+        self.limit = os.cpu_count() or 1
+
+    def request(self, paths, urgent=False):
+        with self.lock:
+            for path in paths:
+                if path in self.queued:
+                    if urgent and path in self.pending:
+                        self.pending.remove(path)
+                        self.pending.appendleft(path)
+                    continue
+                self.queued.add(path)
+                if urgent:
+                    self.pending.appendleft(path)
+                else:
+                    self.pending.append(path)
+        self.pump()
+
+    def has_peaks(self, path):
+        digest = self.index.cached_hash(path)
+        return digest is not None and os.path.exists(os.path.join(self.folder, digest + ".peaks"))
+
+    def missing(self, paths):
+        return [path for path in paths if not self.has_peaks(path)]
+
+    def pump(self):
+        while True:
+            with self.lock:
+                if not self.pending or self.in_flight >= self.limit:
+                    return
+                path = self.pending.popleft()
+                self.in_flight += 1
+            future = shared_pool().submit(build_waveform, path, self.folder, self.index.cached_hash(path))
+            future.add_done_callback(lambda f, p=path: self.on_done(p, f))
+
+    def on_done(self, path, future):
+        with self.lock:
+            self.in_flight -= 1
+            self.queued.discard(path)
+        try:
+            hashed, built = future.result()
+        except Exception:
+            hashed, built = None, False
+        if hashed is not None:
+            self.index.store_hash(path, *hashed)
+        if built:
+            self.ready.emit(path)
+        self.pump()
+
+class WaveformSlider(QSlider):
+    def __init__(self, orientation, parent=None):
+        super().__init__(orientation, parent)
+        self.peaks = None
+        self.layers = None
+
+    def set_peaks(self, peaks):
+        self.peaks = peaks
+        self.layers = None
+        self.update()
+
+    def resizeEvent(self, event):
+        self.layers = None
+        super().resizeEvent(event)
+
+    def build_layers(self):
+        width, height = self.width(), self.height()
+        layers = []
+        for color in ("#4f545c", "#5865F2"):
+            pixmap = QPixmap(width, height)
+            pixmap.fill(Qt.GlobalColor.transparent)
+            painter = QPainter(pixmap)
+            count = len(self.peaks)
+            for x in range(0, width, 2):
+                bar = max(2, int(self.peaks[x * count // width] / 255 * (height - 4)))
+                painter.fillRect(x, (height - bar) // 2, 1, bar, QColor(color))
+            painter.end()
+            layers.append(pixmap)
+        return layers
+
+    def paintEvent(self, event):
+        if not self.peaks:
+            super().paintEvent(event)
+            return
+        if self.layers is None:
+            self.layers = self.build_layers()
+        span = self.maximum() - self.minimum()
+        played = int(self.width() * (self.sliderPosition() - self.minimum()) / span) if span > 0 else 0
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.layers[0])
+        painter.drawPixmap(0, 0, self.layers[1], 0, 0, played, self.height())
+        painter.end()
+
+    def seek_to(self, x):
+        self.setSliderPosition(QStyle.sliderValueFromPosition(self.minimum(), self.maximum(), int(x), self.width()))
+
+    def mousePressEvent(self, event):
+        if event.button() != Qt.MouseButton.LeftButton or self.maximum() <= self.minimum():
+            super().mousePressEvent(event)
+            return
+        self.setSliderDown(True)
+        self.seek_to(event.position().x())
+
+    def mouseMoveEvent(self, event):
+        if self.isSliderDown():
+            self.seek_to(event.position().x())
+        else:
+            super().mouseMoveEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        if self.isSliderDown():
+            self.setSliderDown(False)
+        else:
+            super().mouseReleaseEvent(event)
+
+class LibraryIndexer:
+    def __init__(self, index):
+        self.index = index
+        self.allowed = threading.Event()
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.queue = []
+        self.thread = None
+
+    def request(self, folders):
+        with self.lock:
+            for folder in folders:
+                if folder not in self.queue:
+                    self.queue.append(folder)
+        self.wakeup.set()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def pause(self):
+        self.allowed.clear()
+
+    def resume(self):
+        self.allowed.set()
+
+    def run(self):
+        lower_thread_priority()
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                if not self.queue:
+                    self.wakeup.clear()
+                    continue
+                folder = self.queue.pop(0)
+            self.index_folder(folder)
+
+    def index_folder(self, folder):
+        self.allowed.wait()
+        started = time.monotonic()
+        try:
+            files = [f for f in os.listdir(folder) if f.lower().endswith(".mp3")]
+        except Exception:
+            return
+        cached = self.index.folder_entries(folder)
+        seen = set()
+        batch = []
+        for f in files:
+            self.allowed.wait()
+            full_path = os.path.join(folder, f)
+            seen.add(full_path)
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                continue
+            if is_indexed(cached.get(full_path), st):
+                continue
+            batch.append(index_entry(full_path, st))
+            if len(batch) >= INDEXER_BATCH:
+                self.index.store_many(batch)
+                indexed_tracks.inc(amount=len(batch))
+                batch = []
+        if batch:
+            self.index.store_many(batch)
+            indexed_tracks.inc(amount=len(batch))
+        self.index.prune(folder, seen)
+        scan_seconds.observe(time.monotonic() - started, "index")
+
+ROOT_SCAN_TIMEOUT_MS = 3000
+ROOT_BACKOFF_MAX_MS = 300000
+
+class RootScanner(QObject):
+    scanned = pyqtSignal(str, list, float)
+    failed = pyqtSignal(str, str)
+    done = pyqtSignal()
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = root
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            items = [d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d))]
+            items.sort()
+            scan_seconds.observe(time.monotonic() - started, "root")
+            self.scanned.emit(self.root, items, (time.monotonic() - started) * 1000)
+        except Exception as e:
+            scan_failures.inc()
+            self.failed.emit(self.root, str(e))
+        self.done.emit()
+
+class LibraryRoots(QObject):
+    changed = pyqtSignal(str)
+
+    def __init__(self, settings):
+        super().__init__()
+        self.settings = settings
+        self.roots = [os.path.normpath(r) for r in settings.value("root_folders", [], type=list) if r]
+        legacy = settings.value("root_folder", "")
+        if not self.roots and legacy:
+            self.roots = [os.path.normpath(legacy)]
+        try:
+            self.state = json.loads(settings.value("root_state", "{}"))
+        except Exception:
+            self.state = {}
+        self.online = set()
+        self.scanners = {}
+        self.stuck = set()
+        self.failures = {}
+        self.generation = {}
+        self.retries = {}
+
+    def root_state(self, root):
+        return self.state.setdefault(root, {"playlists": [], "available": False,
+                                            "timeout": ROOT_SCAN_TIMEOUT_MS})
+
+    def playlists(self):
+        result = []
+        for root in self.roots:
+            for name in self.root_state(root)["playlists"]:
+                result.append((root, name))
+        return result
+
+    def is_online(self, root):
+        return root in self.online
+
+    def add_root(self, root):
+        root = os.path.normpath(root)
+        if root in self.roots:
+            self.scan(root, force=True)
+            return
+        self.roots.append(root)
+        self.save()
+        self.scan(root, force=True)
+
+    def remove_root(self, root):
+        if root not in self.roots:
+            return
+        self.roots.remove(root)
+        self.state.pop(root, None)
+        self.online.discard(root)
+        self.failures.pop(root, None)
+        self.cancel_retry(root)
+        self.save()
+        self.changed.emit(root)
+
+    def scan_all(self):
+        for root in self.roots:
+            self.scan(root, force=True)
+
+    def scan(self, root, force=False):
+        if root not in self.roots or (root in self.retries and not force):
+            return
+        if root in self.scanners:
+            if root in self.stuck:
+                self.mark_offline(root)
+            return
+        gen = self.generation.get(root, 0) + 1
+        self.generation[root] = gen
+        scanner = RootScanner(root)
+        scanner.scanned.connect(self.on_scanned)
+        scanner.failed.connect(self.on_failed)
+        scanner.done.connect(lambda r=root, s=scanner: self.on_scanner_done(r, s))
+        self.scanners[root] = scanner
+        QTimer.singleShot(int(self.root_state(root)["timeout"]), lambda r=root, g=gen: self.on_timeout(r, g))
+        scanner.start()
+
+    def on_scanner_done(self, root, scanner):
+        if self.scanners.get(root) is scanner:
+            del self.scanners[root]
+            self.stuck.discard(root)
+
+    def on_scanned(self, root, items, elapsed_ms):
+        if root not in self.roots:
+            return
+        state = self.root_state(root)
+        state["playlists"] = items
+        state["available"] = True
+        state["scanned"] = time.time()
+        state["timeout"] = max(ROOT_SCAN_TIMEOUT_MS, min(ROOT_BACKOFF_MAX_MS // 10, int(elapsed_ms * 4)))
+        self.failures[root] = 0
+        self.cancel_retry(root)
+        self.online.add(root)
+        self.save()
+        self.changed.emit(root)
+
+    def on_failed(self, root, error):
+        if root not in self.roots:
+            return
+        self.mark_offline(root)
+
+    def on_timeout(self, root, gen):
+        if self.generation.get(root) != gen or root not in self.scanners:
+            return
+        self.stuck.add(root)
+        self.mark_offline(root)
+
+    def mark_offline(self, root):
+        self.online.discard(root)
+        self.root_state(root)["available"] = False
+        failures = self.failures.get(root, 0) + 1
+        self.failures[root] = failures
+        delay = min(ROOT_BACKOFF_MAX_MS, ROOT_SCAN_TIMEOUT_MS * 2 ** min(failures, 16))
+        self.cancel_retry(root)
+        timer = QTimer(self)
+        timer.setSingleShot(True)
+        timer.timeout.connect(lambda r=root: self.on_retry(r))
+        timer.start(delay)
+        self.retries[root] = timer
+        self.changed.emit(root)
+
+    def cancel_retry(self, root):
+        timer = self.retries.pop(root, None)
+        if timer is not None:
+            timer.stop()
+            timer.deleteLater()
+
+    def on_retry(self, root):
+        self.cancel_retry(root)
+        self.scan(root)
+
+    def save(self):
+        self.settings.setValue("root_folders", self.roots)
+        self.settings.setValue("root_state", json.dumps({r: self.root_state(r) for r in self.roots}))
+
+def download_journal_path():
+    return os.path.join(app_cache_dir(), "downloads.json")
+
+def read_json(path, default):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def write_json(path, data):
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except OSError:
+        try: os.remove(temp_path)
+        except OSError: pass
+
+def load_download_journal():
+    return read_json(download_journal_path(), {"next_id": 1, "jobs": []})
+
+def save_download_journal(journal):
+    write_json(download_journal_path(), journal)
+
+def staging_dir(folder, job_id):
+    return os.path.join(folder, DOWNLOAD_STAGING, str(job_id))
+
+def clean_staging(folders, active, below):
+    for folder in folders:
+        base = os.path.join(folder, DOWNLOAD_STAGING)
+        try:
+            names = os.listdir(base)
+        except OSError:
+            names = []
+        for name in names:
+            if name.isdigit() and int(name) < below and int(name) not in active:
+                shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+        try: os.rmdir(base)
+        except OSError: pass
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            continue
+        for name in names:
+            if name.endswith(DOWNLOAD_TEMP_SUFFIXES):
+                try: os.remove(os.path.join(folder, name))
+                except OSError: pass
+
+def extract_media_info(url, flat):
+    import yt_dlp
+
+    ydl_opts = {'quiet': True, 'no_warnings': True, 'skip_download': True}
+    if flat:
+        ydl_opts['extract_flat'] = 'in_playlist'
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.extract_info(url, download=False, process=flat)
+
+def downloaded_name(title):
+    from yt_dlp.utils import sanitize_filename
+    return sanitize_filename(title) + ".mp3"
+
+def preview_entry(info):
+    duration = info.get("duration")
+    return {"id": info.get("id"), "url": info.get("webpage_url") or info.get("url") or info.get("id"),
+            "title": info.get("title") or "", "duration": duration,
+            "size": int(duration * MP3_BYTES_PER_SECOND) if duration else None}
+
+class PlaylistPreviewer:
+    def __init__(self, extractor=extract_media_info):
+        self.extractor = extractor
+        self.cache = BudgetCache("previews")
+
+    def preview(self, url):
+        cached = self.cache.get(url)
+        if cached is not None and time.monotonic() - cached[0] < PREVIEW_CACHE_SECONDS:
+            return cached[1]
+        started = time.monotonic()
+        info = self.extractor(url, True)
+        entries = [preview_entry(e) for e in (info.get("entries") if "entries" in info else [info]) if e]
+        missing = [e for e in entries if not e["title"] or e["duration"] is None]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(PREVIEW_WORKERS, len(missing))) as pool:
+                for entry, detail in zip(missing, pool.map(self.extract_detail, [e["url"] for e in missing])):
+                    if detail is not None:
+                        entry.update({k: v for k, v in preview_entry(detail).items() if v and k != "url"})
+        self.cache.put(url, (time.monotonic(), entries),
+                       list_size(entries) + sum(list_size(list(e.values())) for e in entries),
+                       time.monotonic() - started)
+        return entries
+
+    def extract_detail(self, url):
+        try:
+            return self.extractor(url, False)
+        except Exception:
+            return None
+
+class DownloadThread(QThread):
+    progress = pyqtSignal(str) 
+    published = pyqtSignal(str)
+    finished = pyqtSignal()
+    
+    def __init__(self, url, folder, is_playlist, staging, artwork_max_size=ARTWORK_MAX_SIZE, entries=None):
+        super().__init__()
+        self.url = url
+        self.entries = entries
+        self.folder = folder
+        self.is_playlist = is_playlist
+        self.staging = staging
+        self.artwork_max_size = artwork_max_size
+        self.created_artwork = []
+        self.failed = False
+        self.started = False
+        self.offline = False
+        self.rate_limit = None
+        self.ydl = None
+
+    def set_rate_limit(self, limit):
+        self.rate_limit = limit
+        if self.ydl is not None:
+            self.ydl.params['ratelimit'] = limit
+
+    def prepare_artwork(self, info):
+        for thumbnail in info.get('thumbnails') or []:
+            source = thumbnail.get('filepath')
+            if not source or not os.path.exists(source):
+                continue
+            target = os.path.join(self.staging, f"artwork-{len(self.created_artwork)}.jpg")
+            if not make_artwork(source, target, self.artwork_max_size):
+                continue
+            self.created_artwork.append(target)
+            thumbnail['filepath'] = target
+            if os.path.dirname(os.path.abspath(source)) == os.path.abspath(self.staging):
+                try: os.remove(source)
+                except OSError: pass
+
+    def remove_artwork(self):
+        for path in self.created_artwork:
+            try: os.remove(path)
+            except OSError: pass
+        self.created_artwork = []
+
+    def run(self):
+        import yt_dlp
+        from yt_dlp.postprocessor import PostProcessor
+
+        thread = self
+        class ArtworkPP(PostProcessor):
+            def run(self, info):
+                thread.prepare_artwork(info)
+                return [], info
+
+        lower_thread_priority()
+        try:
+            if not os.path.isdir(self.folder):
+                self.offline = not os.path.isdir(os.path.dirname(self.folder))
+                raise OSError(f"{self.folder} is not available")
+            os.makedirs(self.staging, exist_ok=True)
+            self.started = True
+            before = set(os.listdir(self.folder))
+            def on_published(path):
+                self.remove_artwork()
+                if os.path.basename(path) not in before and path.lower().endswith(".mp3"):
+                    self.published.emit(path)
+
+            ydl_opts = {
+                'format': 'bestaudio/best',
+                'outtmpl': '%(title)s.%(ext)s',
+                'paths': {'home': self.folder, 'temp': self.staging},
+                'download_archive': os.path.join(self.staging, 'archive.txt'),
+                'continuedl': True,
+                'ratelimit': self.rate_limit,
+                'post_hooks': [on_published],
+                'postprocessors': [
+                    {'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'},
+                    {'key': 'EmbedThumbnail'},
+                    {'key': 'FFmpegMetadata', 'add_metadata': True}
+                ],
+                'writethumbnail': True,
+                'noplaylist': not self.is_playlist,
+                'quiet': True,
+                'no_warnings': True,
+                'postprocessor_args': {'ffmpeg': ['-id3v2_version', '3']}, 
+            }
+
+            self.progress.emit("Starting download... Please wait.")
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                self.ydl = ydl
+                ydl.params['ratelimit'] = self.rate_limit
+                ydl.add_post_processor(ArtworkPP(ydl), when='before_dl')
+                ydl.download(self.entries or [self.url])
+            self.progress.emit("Success! Refreshing list...")
+        except Exception as e:
+            self.failed = True
+            self.progress.emit(f"Error: {str(e)}")
+
+        self.ydl = None
+        self.remove_artwork()
+        if self.started:
+            shutil.rmtree(self.staging, ignore_errors=True)
+            try: os.rmdir(os.path.dirname(self.staging))
+            except OSError: pass
+        self.finished.emit()
+
+def engine_socket_name():
+    if sys.platform.startswith("win"):
+        return "LocalMusicPlayer"
+    base = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.RuntimeLocation) or tempfile.gettempdir()
+    return os.path.join(base, "localmusicplayer.sock")
+
+def scan_playlist(path):
+    files = [f for f in os.listdir(path) if f.lower().endswith(".mp3")]
+    stats = {f: os.stat(os.path.join(path, f)) for f in files}
+    files.sort(key=lambda x: stats[x].st_mtime)
+    return [os.path.join(path, f) for f in files], [stats[f] for f in files]
+
+class ResourceScheduler(QObject):
+    def __init__(self, player, waveforms, enabled=True):
+        super().__init__()
+        self.player = player
+        self.waveforms = waveforms
+        self.enabled = enabled
+        self.throttled = False
+        self.full_workers = os.cpu_count() or 1
+        self.download = None
+        self.stalled = False
+        self.last_position = None
+        self.last_clock = 0.0
+        self.underruns = {"throttled": 0, "full": 0}
+        self.play_seconds = {"throttled": 0.0, "full": 0.0}
+
+        self.ramp_timer = QTimer(self)
+        self.ramp_timer.setSingleShot(True)
+        self.ramp_timer.setInterval(RAMP_UP_DELAY_MS)
+        self.ramp_timer.timeout.connect(lambda: self.set_throttled(False))
+        self.probe_timer = QTimer(self)
+        self.probe_timer.setInterval(UNDERRUN_PROBE_MS)
+        self.probe_timer.timeout.connect(self.probe)
+        player.playbackStateChanged.connect(self.on_playback_state)
+        player.mediaStatusChanged.connect(self.on_media_status)
+
+    def is_playing(self):
+        return self.player.playbackState() == QMediaPlayer.PlaybackState.PlayingState
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        self.set_throttled(enabled and self.is_playing())
+
+    def set_throttled(self, throttled):
+        if throttled == self.throttled:
+            return
+        self.throttled = throttled
+        workers = max(1, self.full_workers // PLAYBACK_WORKER_SHARE) if throttled else self.full_workers
+        background_gate.set_limit(workers)
+        self.waveforms.limit = workers
+        if self.download is not None:
+            self.download.set_rate_limit(self.rate_limit())
+        if not throttled:
+            self.waveforms.pump()
+
+    def rate_limit(self):
+        return PLAYBACK_RATE_LIMIT if self.throttled else None
+
+    def attach_download(self, thread):
+        self.download = thread
+        if thread is not None:
+            thread.set_rate_limit(self.rate_limit())
+
+    def on_playback_state(self, state):
+        if state == QMediaPlayer.PlaybackState.PlayingState:
+            self.ramp_timer.stop()
+            self.set_throttled(self.enabled)
+            self.reset_probe()
+            self.probe_timer.start()
+        else:
+            self.probe_timer.stop()
+            self.ramp_timer.start()
+
+    def reset_probe(self):
+        self.last_position = self.player.position()
+        self.last_clock = time.monotonic()
+
+    def count_underrun(self):
+        if not self.stalled:
+            self.stalled = True
+            self.underruns["throttled" if self.throttled else "full"] += 1
+
+    def on_media_status(self, status):
+        if status in (QMediaPlayer.MediaStatus.StalledMedia, QMediaPlayer.MediaStatus.BufferingMedia) and self.is_playing():
+            self.count_underrun()
+
+    def probe(self):
+        now = time.monotonic()
+        position = self.player.position()
+        if self.player.mediaStatus() != QMediaPlayer.MediaStatus.BufferedMedia:
+            self.last_position, self.last_clock = position, now
+            return
+        expected = (now - self.last_clock) * 1000 * self.player.playbackRate()
+        advanced = position - self.last_position
+        self.play_seconds["throttled" if self.throttled else "full"] += expected / 1000
+        if 0 <= advanced < expected - UNDERRUN_SLACK_MS:
+            self.count_underrun()
+        elif advanced >= expected - UNDERRUN_SLACK_MS:
+            self.stalled = False
+        self.last_position, self.last_clock = position, now
+
+    def report(self):
+        return {"enabled": self.enabled, "throttled": self.throttled, "rate_limit": self.rate_limit(),
+                "workers": background_gate.limit, "underruns": self.underruns,
+                "play_seconds": {mode: round(seconds, 1) for mode, seconds in self.play_seconds.items()}}
+
+PLAYBACK_STATES = {
+    QMediaPlayer.PlaybackState.PlayingState: "playing",
+    QMediaPlayer.PlaybackState.PausedState: "paused",
+    QMediaPlayer.PlaybackState.StoppedState: "stopped",
+}
+
+class PlayerEngine(QObject):
+    engine_event = pyqtSignal(str, list)
+    call_done = pyqtSignal(object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.settings = QSettings("LocalMusicPlayer", "Config")
+        self.call_done.connect(lambda callback, result: callback(result))
+
+        self.roots = LibraryRoots(self.settings)
+        self.roots.changed.connect(self.on_root_changed)
+        self.index = LibraryIndex()
+        self.indexer = LibraryIndexer(self.index)
+        self.loudness = LoudnessAnalyzer(self.index)
+        self.loudness.analyzed.connect(self.on_loudness_analyzed)
+        self.loudness.progress.connect(self.on_loudness_progress)
+        self.waveforms = WaveformCache(self.index)
+        self.waveforms.ready.connect(lambda path: self.emit_event("waveform_ready", path))
+        self.previewer = PlaylistPreviewer()
+        self.importer = BulkImporter(self.index)
+        self.device_sync = DeviceSync(self.index)
+        self.tag_editor = TagEditor(self.index)
+        self.history = PlayHistory(self.index)
+        self.playing = None
+        QCoreApplication.instance().aboutToQuit.connect(self.on_about_to_quit)
+        self.tag_editor.progress.connect(lambda done, total: self.emit_event(
+            "status", f"Tags: {done}/{total} files", 0))
+        self.tag_editor.updated.connect(lambda rows: self.emit_event("tags_updated", rows))
+        self.tag_editor.finished.connect(lambda counts: self.emit_event(
+            "status", f"Tags: {counts['changed']} updated ({counts['in_place']} in place), "
+                      f"{counts['unchanged']} unchanged, {counts['failed']} failed", 10000))
+        self.device_sync.progress.connect(lambda done, total, elapsed, size: self.emit_event(
+            "status", f"Sync: {done}/{total} tracks ({size / elapsed / 1e6 if elapsed > 0 else 0:.1f} MB/s)", 0))
+        self.device_sync.finished.connect(self.on_sync_finished)
+        self.importer.progress.connect(self.on_import_progress)
+        self.importer.finished.connect(self.on_import_finished)
+        self.duplicates = DuplicateFinder(self.index)
+        self.duplicates.progress.connect(lambda done, total: self.emit_event(
+            "status", f"Duplicates: fingerprinting {done}/{total} tracks", 0))
+        self.duplicates.found.connect(lambda groups: self.emit_event("duplicates", groups))
+
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(INDEXER_IDLE_MS)
+        self.idle_timer.timeout.connect(self.on_idle)
+
+        journal = load_download_journal()
+        self.next_job_id = journal["next_id"]
+        self.downloads = [dict(job, status="queued") for job in journal["jobs"]]
+        self.download_thread = None
+        self.download_started = 0.0
+
+        self.listings = BudgetCache("listings")
+        self.queue = []
+        self.queue_playlist = ""
+        self.current_index = -1
+        self.current_file = ""
+        self.track_requested = None
+        self.track_gain = 1.0
+        self.play_serial = 0
+        self.is_shuffled = False
+        self.is_looping = False
+        memory_budget.set_limit(self.settings.value("memory_budget_mb", MEMORY_BUDGET_MB, type=int) << 20)
+        self.volume = self.settings.value("volume", 70, type=int)
+        self.normalize_volume = self.settings.value("normalize_volume", True, type=bool)
+
+        self.player = QMediaPlayer()
+        self.audio_output = QAudioOutput()
+        self.player.setAudioOutput(self.audio_output)
+        self.player.mediaStatusChanged.connect(self.on_media_status_changed)
+        self.player.positionChanged.connect(lambda position: self.emit_event("position", position))
+        self.player.durationChanged.connect(lambda duration: self.emit_event("duration", duration))
+        self.player.playbackStateChanged.connect(lambda state: self.emit_event("playback", PLAYBACK_STATES[state]))
+        self.player.errorOccurred.connect(lambda error, text: playback_errors.inc())
+        self.apply_volume()
+        self.scheduler = ResourceScheduler(self.player, self.waveforms,
+                                           self.settings.value("background_throttling", True, type=bool))
+
+        self.metrics_server = MetricsServer()
+        self.window_caches = {}
+        self.lag_clock = 0.0
+        self.lag_timer = QTimer(self)
+        self.lag_timer.setInterval(EVENT_LOOP_PROBE_MS)
+        self.lag_timer.timeout.connect(self.probe_event_loop)
+        metrics.on_collect(self.collect_metrics)
+        try:
+            self.set_metrics_port(self.settings.value("metrics_port", 0, type=int))
+        except OSError as e:
+            self.emit_event("status", f"Metrics endpoint unavailable: {e}", 10000)
+
+        self.roots.scan_all()
+        self.idle_timer.start()
+        if self.downloads:
+            self.emit_event("status", f"Resuming {len(self.downloads)} interrupted download(s)...", 10000)
+            self.start_next_download()
+
+    def emit_event(self, name, *args):
+        self.engine_event.emit(name, list(args))
+
+    def run_in_thread(self, func, callback):
+        def work():
+            try:
+                result = func()
+            except Exception:
+                result = None
+            self.call_done.emit(callback, result)
+        threading.Thread(target=work, daemon=True).start()
+
+    def is_busy(self):
+        return (self.player.playbackState() == QMediaPlayer.PlaybackState.PlayingState
+                or self.download_thread is not None or self.loudness.running or self.duplicates.running
+                or self.importer.running or self.device_sync.running or self.tag_editor.running
+                or self.waveforms.in_flight > 0)
+
+    def library_state(self, changed=""):
+        return {"roots": list(self.roots.roots),
+                "online": [r for r in self.roots.roots if self.roots.is_online(r)],
+                "playlists": [[root, name] for root, name in self.roots.playlists()],
+                "changed": changed}
+
+    def settings_state(self):
+        return {"volume": self.volume, "normalize": self.normalize_volume,
+                "shuffle": self.is_shuffled, "loop": self.is_looping}
+
+    def track_state(self):
+        return {"playlist": self.queue_playlist, "index": self.current_index, "file": self.current_file}
+
+    def online_playlists(self):
+        return [os.path.join(root, name) for root, name in self.roots.playlists() if self.roots.is_online(root)]
+
+    def mark_busy(self):
+        self.indexer.pause()
+        self.idle_timer.start()
+
+    def on_idle(self):
+        if self.download_thread is not None:
+            self.idle_timer.start()
+            return
+        self.indexer.resume()
+
+    def on_root_changed(self, root):
+        if self.roots.is_online(root):
+            folders = [os.path.join(root, name) for r, name in self.roots.playlists() if r == root]
+            self.indexer.request(folders)
+            active = {job["id"] for job in self.downloads if job["status"] in ("queued", "running")}
+            threading.Thread(target=clean_staging, args=(folders, active, self.next_job_id), daemon=True).start()
+            self.start_next_download()
+        self.emit_event("library", self.library_state(root))
+
+    def list_tracks(self, path):
+        started = time.monotonic()
+        tracks, stats = scan_playlist(path)
+        cached = self.index.folder_entries(path)
+        fresh = []
+        added = {}
+        for full_path, st in zip(tracks, stats):
+            entry = cached.get(full_path)
+            added[full_path] = entry[5] if entry and entry[5] is not None else st.st_mtime
+            if not is_indexed(entry, st):
+                fresh.append(index_entry(full_path, st))
+        if fresh:
+            self.index.store_many(fresh)
+            indexed_tracks.inc(amount=len(fresh))
+        tracks.sort(key=added.get)
+        elapsed = time.monotonic() - started
+        scan_seconds.observe(elapsed, "playlist")
+        self.listings.put(path, tracks, list_size(tracks), elapsed)
+        return tracks
+
+    def cmd_state(self):
+        return {"library": self.library_state(), "settings": self.settings_state(), "track": self.track_state(),
+                "playback": PLAYBACK_STATES[self.player.playbackState()], "position": self.player.position(),
+                "duration": self.player.duration(), "downloads": self.downloads, "scheduler": self.scheduler.report()}
+
+    def cmd_add_root(self, path):
+        self.roots.add_root(path)
+
+    def cmd_remove_root(self, path):
+        self.roots.remove_root(path)
+
+    def cmd_rescan(self):
+        self.roots.scan_all()
+
+    def root_online(self, playlist):
+        root = os.path.dirname(playlist)
+        if self.roots.is_online(root):
+            return True
+        self.roots.scan(root)
+        return False
+
+    def cmd_tracks(self, reply, playlist):
+        if not self.root_online(playlist):
+            reply({"tracks": [], "offline": True})
+            return
+        def work():
+            tracks = self.list_tracks(playlist)
+            return tracks, self.waveforms.missing(tracks)
+        def done(result):
+            tracks, missing = result or ([], [])
+            self.waveforms.request(missing)
+            reply({"tracks": tracks, "offline": False})
+        self.run_in_thread(work, done)
+
+    def finish_play(self, completed):
+        if self.playing is not None:
+            self.history.record(*self.playing, completed)
+            self.playing = None
+
+    def on_about_to_quit(self):
+        self.finish_play(False)
+        self.history.flush()
+
+    def cmd_history(self, reply, view="most", limit=HISTORY_LIMIT):
+        folders = self.online_playlists()
+        self.run_in_thread(lambda: self.history.query(view, folders, int(limit)), reply)
+
+    def cmd_play(self, reply, playlist, index=0, path=""):
+        if not self.root_online(playlist):
+            self.emit_event("status", "Library folder is not responding", 5000)
+            reply(False)
+            return
+        tracks = self.listings.get(playlist)
+        if tracks is not None and (not path or path in tracks):
+            reply(self.play_queue(playlist, tracks, index, path))
+            return
+        serial = self.play_serial
+        def done(tracks):
+            if tracks is None or serial != self.play_serial:
+                reply(False)
+                return
+            reply(self.play_queue(playlist, tracks, index, path))
+        self.run_in_thread(lambda: self.list_tracks(playlist), done)
+
+    def play_queue(self, playlist, tracks, index, path):
+        self.queue = tracks
+        self.queue_playlist = playlist
+        if path:
+            if path not in tracks:
+                return False
+            index = tracks.index(path)
+        return self.play_index(index)
+
+    def play_index(self, index):
+        if not 0 <= index < len(self.queue) or not self.root_online(self.queue_playlist):
+            return False
+        file_path = self.queue[index]
+        self.mark_busy()
+        self.play_serial += 1
+        self.current_index = index
+        self.current_file = file_path
+        self.finish_play(False)
+        self.playing = (file_path, time.time())
+        self.track_requested = time.monotonic()
+        self.player.setSource(QUrl.fromLocalFile(file_path))
+        self.player.play()
+        self.scheduler.reset_probe()
+        self.emit_event("track", self.track_state())
+        self.track_gain = 1.0
+        digest = self.index.cached_hash(file_path)
+        if digest is not None:
+            self.apply_track_hash(file_path, digest)
+        else:
+            self.apply_volume()
+            self.run_in_thread(lambda: self.index.content_hash(file_path),
+                               lambda digest: self.apply_track_hash(file_path, digest))
+        return True
 
-    scaled = pixmap.scaled(target_width, target_height, 
-                           Qt.AspectRatioMode.KeepAspectRatioByExpanding, 
-                           Qt.TransformationMode.SmoothTransformation)
-    
-    x = (scaled.width() - target_width) // 2
-    y = (scaled.height() - target_height) // 2
-    return scaled.copy(x, y, target_width, target_height)
+    def apply_track_hash(self, file_path, digest):
+        if digest is None or file_path != self.current_file:
+            return
+        self.track_gain = self.index.track_gain(digest) or 1.0
+        self.apply_volume()
+        if os.path.exists(os.path.join(self.waveforms.folder, digest + ".peaks")):
+            self.emit_event("waveform_ready", file_path)
+        else:
+            self.waveforms.request([file_path], urgent=True)
 
-class DownloadThread(QThread):
-    progress = pyqtSignal(str) 
-    finished = pyqtSignal()
-    
-    def __init__(self, url, folder, is_playlist):
+    def cmd_pause(self):
+        self.player.pause()
+
+    def cmd_resume(self):
+        if self.current_file:
+            self.player.play()
+
+    def cmd_stop(self):
+        self.player.stop()
+        self.finish_play(False)
+
+    def cmd_next(self):
+        count = len(self.queue)
+        if count == 0:
+            return False
+        if self.is_shuffled:
+            return self.play_index(random.randint(0, count - 1))
+        return self.play_index((self.current_index + 1) % count)
+
+    def cmd_prev(self):
+        count = len(self.queue)
+        if count == 0:
+            return False
+        return self.play_index((self.current_index - 1) % count)
+
+    def cmd_seek(self, position):
+        self.player.setPosition(int(position))
+        self.scheduler.reset_probe()
+
+    def cmd_set_volume(self, value):
+        self.volume = max(0, min(100, int(value)))
+        self.settings.setValue("volume", self.volume)
+        self.apply_volume()
+        self.emit_event("settings", self.settings_state())
+
+    def cmd_set_normalize(self, enabled):
+        self.normalize_volume = bool(enabled)
+        self.settings.setValue("normalize_volume", self.normalize_volume)
+        self.apply_volume()
+        self.emit_event("settings", self.settings_state())
+
+    def cmd_set_shuffle(self, enabled):
+        self.is_shuffled = bool(enabled)
+        self.emit_event("settings", self.settings_state())
+
+    def cmd_set_loop(self, enabled):
+        self.is_looping = bool(enabled)
+        self.emit_event("settings", self.settings_state())
+
+    def cmd_set_throttling(self, enabled):
+        self.settings.setValue("background_throttling", bool(enabled))
+        self.scheduler.set_enabled(bool(enabled))
+        return self.scheduler.report()
+
+    def cmd_scheduler(self):
+        return self.scheduler.report()
+
+    def cmd_interaction(self):
+        self.mark_busy()
+
+    def cmd_preview(self, reply, url, folder=""):
+        def work():
+            try:
+                entries = self.previewer.preview(url)
+            except Exception as e:
+                return {"entries": [], "error": str(e)}
+            names = self.index.track_names()
+            try:
+                names.update(name.lower() for name in os.listdir(folder))
+            except OSError:
+                pass
+            return {"entries": [dict(e, in_library=downloaded_name(e["title"]).lower() in names) for e in entries],
+                    "error": None}
+        self.run_in_thread(work, reply)
+
+    def cmd_download(self, url, folder, is_playlist=False, entries=None):
+        job = {"id": self.next_job_id, "url": url, "folder": folder, "is_playlist": bool(is_playlist),
+               "status": "queued", "files": [], "entries": list(entries) if entries else None}
+        self.next_job_id += 1
+        self.downloads.append(job)
+        self.save_downloads()
+        self.start_next_download()
+        return job["id"]
+
+    def save_downloads(self):
+        save_download_journal({"next_id": self.next_job_id,
+                               "jobs": [j for j in self.downloads if j["status"] in ("queued", "running")]})
+
+    def cmd_downloads(self):
+        return self.downloads
+
+    def download_ready(self, job):
+        root = os.path.dirname(job["folder"])
+        return root not in self.roots.roots or self.roots.is_online(root)
+
+    def start_next_download(self):
+        if self.download_thread is not None:
+            return
+        job = next((j for j in self.downloads if j["status"] == "queued" and self.download_ready(j)), None)
+        if job is None:
+            return
+        job["status"] = "running"
+        self.save_downloads()
+        self.mark_busy()
+        self.download_thread = DownloadThread(job["url"], job["folder"], job["is_playlist"],
+                                              staging_dir(job["folder"], job["id"]),
+                                              self.settings.value("artwork_max_size", ARTWORK_MAX_SIZE, type=int),
+                                              job.get("entries"))
+        self.download_thread.progress.connect(lambda text, j=job["id"]: self.emit_event("download_progress", j, text))
+        self.download_thread.published.connect(lambda path, j=job: self.on_download_published(j, path))
+        self.scheduler.attach_download(self.download_thread)
+        self.download_thread.finished.connect(lambda j=job: self.on_download_finished(j))
+        self.download_started = time.monotonic()
+        self.download_thread.start()
+
+    def on_download_finished(self, job):
+        thread = self.download_thread
+        thread.wait()
+        self.download_thread = None
+        self.scheduler.attach_download(None)
+        root = os.path.dirname(thread.folder)
+        if thread.offline and root in self.roots.roots:
+            job["status"] = "queued"
+            self.save_downloads()
+            self.roots.mark_offline(root)
+            self.emit_event("download_progress", job["id"], "Waiting for the library folder...")
+            self.start_next_download()
+            return
+        job["status"] = "failed" if thread.failed else "finished"
+        downloads_total.inc(job["status"])
+        download_seconds.observe(time.monotonic() - self.download_started, job["status"])
+        self.save_downloads()
+        self.indexer.request([thread.folder])
+        self.idle_timer.start()
+        if job["files"]:
+            self.loudness.analyze(job["files"])
+            self.waveforms.request(job["files"])
+        self.emit_event("download_finished", job["id"], thread.folder, job["files"])
+        self.start_next_download()
+
+    def on_download_published(self, job, path):
+        if path not in job["files"]:
+            job["files"].append(path)
+            downloaded_files.inc()
+            self.save_downloads()
+
+    def cmd_analyze_loudness(self, paths=None):
+        paths = paths or self.online_playlists()
+        if paths:
+            self.emit_event("status", "Loudness: scanning library...", 0)
+            self.loudness.analyze(paths)
+
+    def cmd_find_duplicates(self, paths=None):
+        paths = paths or self.online_playlists()
+        if paths:
+            self.emit_event("status", "Duplicates: scanning library...", 0)
+            self.duplicates.find(paths)
+
+    def cmd_import(self, source, playlist):
+        if not os.path.isdir(source) or not os.path.isdir(playlist):
+            raise ValueError("Source and playlist must be existing folders")
+        self.mark_busy()
+        self.emit_event("status", f"Import: scanning {source}...", 0)
+        self.importer.start(source, playlist)
+
+    def on_import_progress(self, done, total, elapsed, size):
+        rate = done / elapsed if elapsed > 0 else 0
+        throughput = size / elapsed / 1e6 if elapsed > 0 else 0
+        self.emit_event("status", f"Import: {done}/{total} files ({rate:.1f} files/s, {throughput:.1f} MB/s)", 0)
+
+    def on_import_finished(self, playlist, files, skipped, failed):
+        self.indexer.request([playlist])
+        self.idle_timer.start()
+        if files:
+            self.loudness.analyze(files)
+            self.waveforms.request(files)
+        self.emit_event("status", f"Import: {len(files)} imported, {skipped} already imported, {failed} failed",
+                        10000)
+        self.emit_event("imported", playlist, files)
+
+    def cmd_sync(self, playlists, target, bitrate=0):
+        if not playlists or not os.path.isdir(target):
+            raise ValueError("Select playlists and an existing target folder")
+        if int(bitrate) not in SYNC_BITRATES:
+            raise ValueError(f"Bitrate must be one of {', '.join(str(b) for b in SYNC_BITRATES)}")
+        duplicates = duplicate_names(playlists)
+        if duplicates:
+            raise ValueError(f"Playlists with the same name would share a device folder: {', '.join(duplicates)}")
+        self.mark_busy()
+        self.emit_event("status", f"Sync: comparing {len(playlists)} playlist(s) with {target}...", 0)
+        self.device_sync.start(playlists, target, int(bitrate))
+
+    def on_sync_finished(self, target, counts, elapsed):
+        self.idle_timer.start()
+        self.emit_event("status", f"Sync: {counts['copied']} copied, {counts['moved']} moved, "
+                                  f"{counts['removed']} removed, {counts['unchanged']} unchanged, "
+                                  f"{counts['failed']} failed in {elapsed:.1f}s", 10000)
+        self.emit_event("synced", target, counts)
+
+    def cmd_edit_tags(self, paths, pattern="", find="", replace="", fields=("title", "artist")):
+        if not pattern and not find:
+            raise ValueError("Enter a file name pattern or a text to find")
+        if any(field not in TAG_FRAMES for field in fields):
+            raise ValueError(f"Fields must be among {', '.join(TAG_FRAMES)}")
+        self.mark_busy()
+        self.tag_editor.start(paths, pattern, find, replace, fields)
+
+    def cmd_memory(self):
+        return memory_budget.report()
+
+    def cmd_set_memory_budget(self, megabytes):
+        self.settings.setValue("memory_budget_mb", int(megabytes))
+        memory_budget.set_limit(int(megabytes) << 20)
+        return memory_budget.report()
+
+    def cmd_trim_memory(self, fraction=0.0):
+        memory_budget.trim(float(fraction))
+        return memory_budget.report()
+
+    def set_metrics_port(self, port):
+        self.metrics_server.stop()
+        self.lag_timer.stop()
+        if port:
+            self.metrics_server.start(int(port))
+            self.lag_clock = time.monotonic()
+            self.lag_timer.start()
+        return self.metrics_state()
+
+    def metrics_state(self):
+        port = self.metrics_server.port()
+        return {"enabled": bool(port), "url": f"http://{METRICS_HOST}:{port}/metrics" if port else ""}
+
+    def probe_event_loop(self):
+        now = time.monotonic()
+        event_loop_lag_seconds.observe(max(0.0, now - self.lag_clock - EVENT_LOOP_PROBE_MS / 1000))
+        self.lag_clock = now
+
+    def collect_metrics(self):
+        for mode, count in self.scheduler.underruns.items():
+            playback_underruns.set(count, mode)
+        downloads_queued.set(sum(1 for job in self.downloads if job["status"] in ("queued", "running")))
+        local = {cache.name for cache in memory_budget.caches}
+        for name, stats in self.window_caches.items():
+            if name not in local:
+                cache_hits.set(stats["hits"], name)
+                cache_misses.set(stats["misses"], name)
+                cache_evictions.set(stats["evictions"], name)
+                cache_bytes.set(stats["bytes"], name)
+
+    def cmd_report_metrics(self, caches=None, covers=()):
+        self.window_caches = caches or {}
+        for seconds in covers:
+            cover_seconds.observe(seconds, "window")
+
+    def cmd_set_metrics(self, port=METRICS_DEFAULT_PORT):
+        state = self.set_metrics_port(int(port))
+        self.settings.setValue("metrics_port", int(port))
+        return state
+
+    def cmd_metrics(self):
+        return self.metrics_state()
+
+    def cmd_waveform(self, path):
+        self.waveforms.request([path], urgent=True)
+
+    def cmd_quit(self):
+        QTimer.singleShot(0, QCoreApplication.instance().quit)
+
+    def apply_volume(self):
+        gain = self.track_gain if self.normalize_volume else 1.0
+        self.audio_output.setVolume(min(1.0, self.volume / 100 * gain))
+
+    def on_loudness_analyzed(self, path, gain):
+        if path == self.current_file:
+            self.track_gain = gain
+            self.apply_volume()
+
+    def on_loudness_progress(self, done, total, elapsed):
+        rate = done / elapsed if elapsed > 0 else 0
+        self.emit_event("status", f"Loudness: {done}/{total} tracks ({rate:.1f}/s)", 0 if done < total else 10000)
+
+    def on_media_status_changed(self, status):
+        if self.track_requested is not None and status in (QMediaPlayer.MediaStatus.LoadedMedia,
+                                                           QMediaPlayer.MediaStatus.BufferedMedia):
+            track_start_seconds.observe(time.monotonic() - self.track_requested)
+            tracks_started.inc()
+            self.track_requested = None
+        elif status == QMediaPlayer.MediaStatus.InvalidMedia:
+            self.track_requested = None
+        if status == QMediaPlayer.MediaStatus.EndOfMedia:
+            self.finish_play(True)
+            if self.is_looping:
+                self.playing = (self.current_file, time.time())
+                self.player.setPosition(0)
+                self.player.play()
+            else:
+                self.cmd_next()
+
+ASYNC_COMMANDS = {"tracks", "play", "preview", "history"}
+
+class EngineServer(QObject):
+    def __init__(self, engine):
         super().__init__()
-        self.url = url
-        self.folder = folder
-        self.is_playlist = is_playlist
+        self.engine = engine
+        self.server = QLocalServer(self)
+        self.server.setSocketOptions(QLocalServer.SocketOption.UserAccessOption)
+        self.server.newConnection.connect(self.on_new_connection)
+        self.clients = []
+        self.idle_since = time.monotonic()
+        engine.engine_event.connect(self.broadcast)
 
-    def run(self):
-        import yt_dlp
-        
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': f'{self.folder}/%(title)s.%(ext)s',
-            'postprocessors': [
-                {'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'},
-                {'key': 'EmbedThumbnail'},
-                {'key': 'FFmpegMetadata', 'add_metadata': True}
-            ],
-            'writethumbnail': True,
-            'noplaylist': not self.is_playlist,
-            'quiet': True,
-            'no_warnings': True,
-            'postprocessor_args': {'ffmpeg': ['-id3v2_version', '3']}, 
-        }
+    def listen(self, name):
+        probe = QLocalSocket()
+        probe.connectToServer(name)
+        if probe.waitForConnected(500):
+            probe.abort()
+            return False
+        QLocalServer.removeServer(name)
+        return self.server.listen(name)
+
+    def exit_when_idle(self):
+        timer = QTimer(self)
+        timer.timeout.connect(self.check_idle)
+        timer.start(ENGINE_IDLE_CHECK_MS)
+
+    def check_idle(self):
+        if self.clients or self.engine.is_busy():
+            self.idle_since = time.monotonic()
+        elif (time.monotonic() - self.idle_since) * 1000 >= ENGINE_IDLE_EXIT_MS:
+            QCoreApplication.instance().quit()
+
+    def on_new_connection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            self.clients.append(socket)
+            socket.readyRead.connect(lambda s=socket: self.on_ready_read(s))
+            socket.disconnected.connect(lambda s=socket: self.on_disconnected(s))
+
+    def on_disconnected(self, socket):
+        if socket in self.clients:
+            self.clients.remove(socket)
+            socket.deleteLater()
+            if not self.clients:
+                memory_budget.trim()
+
+    def on_ready_read(self, socket):
+        while socket.canReadLine():
+            line = bytes(socket.readLine()).strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            self.dispatch(socket, message)
 
+    def dispatch(self, socket, message):
+        request_id = message.get("id")
+        def reply(result=None, error=None):
+            if error is None:
+                self.send(socket, {"id": request_id, "result": result})
+            else:
+                self.send(socket, {"id": request_id, "error": error})
+        command = str(message.get("cmd"))
+        handler = getattr(self.engine, "cmd_" + command, None)
+        if handler is None:
+            reply(error=f"Unknown command: {command}")
+            return
         try:
-            self.progress.emit("Starting download... Please wait.")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([self.url])
-            self.progress.emit("Success! Refreshing list...")
-            
-            for f in os.listdir(self.folder):
-                if f.endswith(".jpg") or f.endswith(".webp") or f.endswith(".png"):
-                    try: os.remove(os.path.join(self.folder, f))
-                    except: pass
+            if command in ASYNC_COMMANDS:
+                handler(reply, **(message.get("args") or {}))
+            else:
+                reply(handler(**(message.get("args") or {})))
         except Exception as e:
-            self.progress.emit(f"Error: {str(e)}")
-        
-        self.finished.emit()
+            reply(error=str(e))
+
+    def send(self, socket, message):
+        if socket in self.clients:
+            socket.write((json.dumps(message) + "\n").encode())
+
+    def broadcast(self, name, args):
+        data = (json.dumps({"event": name, "args": args}) + "\n").encode()
+        for socket in self.clients:
+            socket.write(data)
+
+class EngineClient(QObject):
+    engine_event = pyqtSignal(str, list)
+    connected = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.socket = QLocalSocket(self)
+        self.socket.connected.connect(self.on_connected)
+        self.socket.disconnected.connect(self.on_disconnected)
+        self.socket.errorOccurred.connect(self.on_error)
+        self.socket.readyRead.connect(self.on_ready_read)
+        self.name = engine_socket_name()
+        self.callbacks = {}
+        self.pending = []
+        self.next_id = 1
+        self.spawned = False
+        self.deadline = 0
+        self.closing = False
+        self.engine = None
+        self.server = None
+
+    def start(self):
+        self.deadline = time.monotonic() + ENGINE_CONNECT_TIMEOUT_MS / 1000
+        self.attempt()
+
+    def attempt(self):
+        self.socket.abort()
+        self.socket.connectToServer(self.name)
+
+    def spawn_daemon(self):
+        try:
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), "--daemon"],
+                             stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                             start_new_session=True)
+            return True
+        except OSError:
+            return False
+
+    def start_in_process(self):
+        self.engine = PlayerEngine()
+        self.server = EngineServer(self.engine)
+        if not self.server.listen(self.name):
+            self.name = f"{engine_socket_name()}.{os.getpid()}"
+            if not self.server.listen(self.name):
+                return
+        QTimer.singleShot(0, self.attempt)
+
+    def on_error(self, error):
+        if self.closing or self.socket.state() == QLocalSocket.LocalSocketState.ConnectedState:
+            return
+        if self.server is not None:
+            return
+        if not self.spawned:
+            self.spawned = True
+            if not self.spawn_daemon():
+                self.start_in_process()
+                return
+        if time.monotonic() < self.deadline:
+            QTimer.singleShot(200, self.attempt)
+        else:
+            self.start_in_process()
+
+    def on_connected(self):
+        for data in self.pending:
+            self.socket.write(data)
+        self.pending = []
+        self.connected.emit()
+
+    def on_disconnected(self):
+        self.callbacks.clear()
+        if not self.closing and self.server is None:
+            self.spawned = False
+            QTimer.singleShot(0, self.start)
+
+    def call(self, command, callback=None, **args):
+        request_id = self.next_id
+        self.next_id += 1
+        if callback is not None:
+            self.callbacks[request_id] = callback
+        data = (json.dumps({"id": request_id, "cmd": command, "args": args}) + "\n").encode()
+        if self.socket.state() == QLocalSocket.LocalSocketState.ConnectedState:
+            self.socket.write(data)
+        else:
+            self.pending.append(data)
+
+    def on_ready_read(self):
+        while self.socket.canReadLine():
+            line = bytes(self.socket.readLine()).strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if "event" in message:
+                self.engine_event.emit(message["event"], message.get("args") or [])
+                continue
+            callback = self.callbacks.pop(message.get("id"), None)
+            if callback is not None and "error" not in message:
+                callback(message.get("result"))
+
+    def close(self):
+        self.closing = True
+        self.socket.flush()
+        self.socket.disconnectFromServer()
+
+def run_daemon():
+    app = QCoreApplication(sys.argv)
+    engine = PlayerEngine()
+    server = EngineServer(engine)
+    if not server.listen(engine_socket_name()):
+        print("Local Music Player engine is already running.", file=sys.stderr)
+        return 1
+    server.exit_when_idle()
+    return app.exec()
+
+def run_ctl(argv):
+    app = QCoreApplication(sys.argv)
+    if not argv:
+        print("usage: localmusic.py --ctl <command> [key=value ...]", file=sys.stderr)
+        return 2
+    args = {}
+    for item in argv[1:]:
+        key, _, value = item.partition("=")
+        try:
+            args[key] = json.loads(value)
+        except ValueError:
+            args[key] = value
+    socket = QLocalSocket()
+    socket.connectToServer(engine_socket_name())
+    if not socket.waitForConnected(2000):
+        print("Local Music Player engine is not running.", file=sys.stderr)
+        return 1
+    socket.write((json.dumps({"id": 1, "cmd": argv[0], "args": args}) + "\n").encode())
+    socket.waitForBytesWritten(2000)
+    while socket.waitForReadyRead(ENGINE_CONNECT_TIMEOUT_MS) or socket.canReadLine():
+        while socket.canReadLine():
+            message = json.loads(bytes(socket.readLine()))
+            if message.get("id") != 1:
+                continue
+            if "error" in message:
+                print(message["error"], file=sys.stderr)
+                return 1
+            print(json.dumps(message.get("result"), indent=2))
+            return 0
+    return 1
 
 class DownloadDialog(QDialog):
     def __init__(self, parent=None):
@@ -78,6 +2993,7 @@ class DownloadDialog(QDialog):
         layout.addWidget(QLabel("YouTube Link:"))
         self.input_url = QLineEdit()
         self.input_url.setPlaceholderText("https://www.youtube.com/watch?v=...")
+        self.input_url.textChanged.connect(self.clear_preview)
         layout.addWidget(self.input_url)
         
         self.rb_video = QRadioButton("Video")
@@ -85,6 +3001,14 @@ class DownloadDialog(QDialog):
         self.rb_video.setChecked(True)
         layout.addWidget(self.rb_video)
         layout.addWidget(self.rb_playlist)
+
+        self.btn_preview = QPushButton("Preview")
+        self.btn_preview.clicked.connect(self.start_preview)
+        layout.addWidget(self.btn_preview)
+        self.list_entries = QListWidget()
+        self.list_entries.itemChanged.connect(self.update_selection)
+        self.list_entries.hide()
+        layout.addWidget(self.list_entries)
         
         self.lbl_status = QLabel("Ready")
         self.lbl_status.setStyleSheet("color: #b9bbbe; font-style: italic;")
@@ -94,7 +3018,69 @@ class DownloadDialog(QDialog):
         self.btn_download.setFixedHeight(40)
         self.btn_download.clicked.connect(self.start_download)
         layout.addWidget(self.btn_download)
-        self.thread = None
+        self.job_id = None
+        self.preview_url = None
+        parent.engine.engine_event.connect(self.on_engine_event)
+
+    def start_preview(self):
+        url = self.input_url.text()
+        if not url:
+            self.lbl_status.setText("Please enter a link!")
+            return
+        self.preview_url = url
+        self.btn_preview.setEnabled(False)
+        self.lbl_status.setText("Reading entries...")
+        self.parent().engine.call("preview", self.on_preview, url=url,
+                                  folder=self.parent().current_playlist_path() or "")
+
+    def on_preview(self, result):
+        self.btn_preview.setEnabled(True)
+        if result is None or self.preview_url != self.input_url.text():
+            return
+        if result["error"]:
+            self.lbl_status.setText(f"Error: {result['error']}")
+            return
+        self.list_entries.blockSignals(True)
+        self.list_entries.clear()
+        for entry in result["entries"]:
+            details = []
+            if entry["duration"]:
+                details.append(f"{int(entry['duration']) // 60}:{int(entry['duration']) % 60:02d}")
+            if entry["size"]:
+                details.append(f"~{entry['size'] / 1e6:.1f} MB")
+            text = entry["title"] or entry["url"]
+            if details:
+                text += f"  ({', '.join(details)})"
+            if entry["in_library"]:
+                text += "  - in library"
+            item = QListWidgetItem(text)
+            item.setData(Qt.ItemDataRole.UserRole, entry)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Unchecked if entry["in_library"] else Qt.CheckState.Checked)
+            self.list_entries.addItem(item)
+        self.list_entries.blockSignals(False)
+        self.list_entries.show()
+        self.setFixedSize(500, 500)
+        self.update_selection()
+
+    def clear_preview(self):
+        self.preview_url = None
+        self.list_entries.clear()
+        self.list_entries.hide()
+        self.setFixedSize(500, 250)
+
+    def selected_entries(self):
+        items = [self.list_entries.item(i) for i in range(self.list_entries.count())]
+        return [item.data(Qt.ItemDataRole.UserRole) for item in items
+                if item.checkState() == Qt.CheckState.Checked]
+
+    def update_selection(self, item=None):
+        selected = self.selected_entries()
+        known = sum(1 for i in range(self.list_entries.count())
+                    if self.list_entries.item(i).data(Qt.ItemDataRole.UserRole)["in_library"])
+        size = sum(entry["size"] or 0 for entry in selected)
+        self.lbl_status.setText(f"{self.list_entries.count()} entries, {known} already in library. "
+                                f"{len(selected)} selected (~{size / 1e6:.0f} MB)")
 
     def start_download(self):
         url = self.input_url.text()
@@ -102,24 +3088,282 @@ class DownloadDialog(QDialog):
             self.lbl_status.setText("Please enter a link!")
             return
         main_window = self.parent()
-        folder_name = main_window.combo_playlist.currentText()
-        if not main_window.root_folder or not folder_name:
+        target_folder = main_window.current_playlist_path()
+        if not target_folder:
             self.lbl_status.setText("Select a playlist first!")
             return
 
-        target_folder = os.path.join(main_window.root_folder, folder_name)
+        entries = None
+        if self.list_entries.count():
+            selected = self.selected_entries()
+            if not selected:
+                self.lbl_status.setText("Nothing selected!")
+                return
+            if len(selected) < self.list_entries.count():
+                entries = [entry["url"] for entry in selected]
+
         self.lbl_status.setText("Downloading...")
         self.btn_download.setEnabled(False)
         
-        self.thread = DownloadThread(url, target_folder, self.rb_playlist.isChecked())
-        self.thread.progress.connect(self.lbl_status.setText)
-        self.thread.finished.connect(self.on_finished)
-        self.thread.start()
+        main_window.engine.call("download", self.on_queued, url=url, folder=target_folder,
+                                is_playlist=self.rb_playlist.isChecked(), entries=entries)
+
+    def on_queued(self, job_id):
+        self.job_id = job_id
+
+    def on_engine_event(self, name, args):
+        if not args or args[0] != self.job_id:
+            return
+        if name == "download_progress":
+            self.lbl_status.setText(args[1])
+        elif name == "download_finished":
+            self.on_finished()
 
     def on_finished(self):
+        self.job_id = None
         self.btn_download.setEnabled(True)
         self.input_url.clear()
-        self.parent().load_songs_from_playlist()
+
+class SyncDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Sync to Device")
+        self.resize(500, 450)
+        self.setStyleSheet(parent.styleSheet())
+        self.settings = parent.settings
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("Playlists:"))
+        self.list_playlists = QListWidget()
+        chosen = self.settings.value("sync_playlists", [], type=list)
+        playlists = [(root, name) for root, name in parent.library["playlists"] if root in parent.library["online"]]
+        shared = set(duplicate_names(name for root, name in playlists))
+        for root, name in playlists:
+            path = os.path.join(root, name)
+            item = QListWidgetItem(f"{name} ({root})" if name in shared else name)
+            item.setData(Qt.ItemDataRole.UserRole, path)
+            item.setToolTip(path)
+            item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Checked if path in chosen else Qt.CheckState.Unchecked)
+            self.list_playlists.addItem(item)
+        layout.addWidget(self.list_playlists)
+
+        target_layout = QHBoxLayout()
+        self.input_target = QLineEdit(self.settings.value("sync_target", ""))
+        self.input_target.setPlaceholderText("Device folder")
+        self.btn_target = QPushButton("Browse...")
+        self.btn_target.clicked.connect(self.choose_target)
+        target_layout.addWidget(self.input_target)
+        target_layout.addWidget(self.btn_target)
+        layout.addLayout(target_layout)
+
+        self.combo_bitrate = QComboBox()
+        for bitrate in SYNC_BITRATES:
+            self.combo_bitrate.addItem(f"MP3 {bitrate} kbps" if bitrate else "Copy original files", bitrate)
+        self.combo_bitrate.setCurrentIndex(max(0, self.combo_bitrate.findData(
+            self.settings.value("sync_bitrate", 0, type=int))))
+        layout.addWidget(self.combo_bitrate)
+
+        self.btn_sync = QPushButton("Sync")
+        self.btn_sync.setFixedHeight(40)
+        self.btn_sync.clicked.connect(self.start_sync)
+        layout.addWidget(self.btn_sync)
+
+    def choose_target(self):
+        folder = QFileDialog.getExistingDirectory(self, "Select Device Folder", self.input_target.text())
+        if folder:
+            self.input_target.setText(folder)
+
+    def start_sync(self):
+        playlists = [self.list_playlists.item(i).data(Qt.ItemDataRole.UserRole)
+                     for i in range(self.list_playlists.count())
+                     if self.list_playlists.item(i).checkState() == Qt.CheckState.Checked]
+        target = self.input_target.text()
+        if not playlists or not os.path.isdir(target):
+            QMessageBox.warning(self, "Warning", "Please select playlists and an existing device folder.")
+            return
+        duplicates = duplicate_names(playlists)
+        if duplicates:
+            QMessageBox.warning(self, "Warning", f"Playlists with the same name would share a device folder: "
+                                                 f"{', '.join(duplicates)}. Select only one of each.")
+            return
+        self.settings.setValue("sync_playlists", playlists)
+        self.settings.setValue("sync_target", target)
+        self.settings.setValue("sync_bitrate", self.combo_bitrate.currentData())
+        self.parent().engine.call("sync", playlists=playlists, target=target, bitrate=self.combo_bitrate.currentData())
+        self.accept()
+
+class TagEditorDialog(QDialog):
+    def __init__(self, paths, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Edit Tags")
+        self.setFixedSize(500, 360)
+        self.setStyleSheet(parent.styleSheet())
+        self.paths = paths
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(f"{len(paths)} tracks"))
+        layout.addWidget(QLabel("Read tags from file names:"))
+        self.input_pattern = QLineEdit(parent.settings.value("tag_pattern", "{artist} - {title}"))
+        self.input_pattern.setPlaceholderText("{artist} - {title}")
+        self.input_pattern.textChanged.connect(self.update_example)
+        layout.addWidget(self.input_pattern)
+        self.lbl_example = QLabel()
+        self.lbl_example.setStyleSheet("color: #b9bbbe; font-style: italic;")
+        self.lbl_example.setWordWrap(True)
+        layout.addWidget(self.lbl_example)
+
+        layout.addWidget(QLabel("Find and replace:"))
+        replace_layout = QHBoxLayout()
+        self.input_find = QLineEdit()
+        self.input_find.setPlaceholderText("Find")
+        self.input_replace = QLineEdit()
+        self.input_replace.setPlaceholderText("Replace with")
+        replace_layout.addWidget(self.input_find)
+        replace_layout.addWidget(self.input_replace)
+        layout.addLayout(replace_layout)
+        self.combo_fields = QComboBox()
+        self.combo_fields.addItem("in Title and Artist", ["title", "artist"])
+        self.combo_fields.addItem("in Title", ["title"])
+        self.combo_fields.addItem("in Artist", ["artist"])
+        self.combo_fields.addItem("in Album", ["album"])
+        layout.addWidget(self.combo_fields)
+
+        self.btn_apply = QPushButton("Apply")
+        self.btn_apply.setFixedHeight(40)
+        self.btn_apply.clicked.connect(self.apply)
+        layout.addWidget(self.btn_apply)
+        self.update_example()
+
+    def update_example(self):
+        if not self.paths:
+            return
+        try:
+            values = parse_tag_pattern(compile_tag_pattern(self.input_pattern.text()), self.paths[0])
+        except ValueError as e:
+            self.lbl_example.setText(str(e))
+            return
+        name = os.path.splitext(os.path.basename(self.paths[0]))[0]
+        if not self.input_pattern.text():
+            self.lbl_example.setText("")
+        elif values:
+            self.lbl_example.setText(f"{name}: " + ", ".join(f"{k} = {v}" for k, v in values.items()))
+        else:
+            self.lbl_example.setText(f"{name}: does not match")
+
+    def apply(self):
+        pattern = self.input_pattern.text()
+        if pattern:
+            try:
+                compile_tag_pattern(pattern)
+            except ValueError as e:
+                QMessageBox.warning(self, "Warning", str(e))
+                return
+            self.parent().settings.setValue("tag_pattern", pattern)
+        if not pattern and not self.input_find.text():
+            QMessageBox.warning(self, "Warning", "Enter a file name pattern or a text to find.")
+            return
+        self.parent().engine.call("edit_tags", paths=self.paths, pattern=pattern, find=self.input_find.text(),
+                                  replace=self.input_replace.text(), fields=self.combo_fields.currentData())
+        self.accept()
+
+class DuplicatesDialog(QDialog):
+    def __init__(self, groups, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Duplicates")
+        self.resize(700, 500)
+        self.setStyleSheet(parent.styleSheet())
+        self.removed = []
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(f"{len(groups)} groups found. Checked files will be moved to the trash."))
+        self.list = QListWidget()
+        for number, group in enumerate(groups, 1):
+            header = QListWidgetItem(f"Group {number}")
+            header.setFlags(Qt.ItemFlag.NoItemFlags)
+            self.list.addItem(header)
+            for i, path in enumerate(group):
+                item = QListWidgetItem(f"{os.path.basename(os.path.dirname(path))} / {os.path.basename(path)}")
+                item.setData(Qt.ItemDataRole.UserRole, path)
+                item.setToolTip(path)
+                item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsUserCheckable)
+                item.setCheckState(Qt.CheckState.Unchecked if i == 0 else Qt.CheckState.Checked)
+                self.list.addItem(item)
+        layout.addWidget(self.list)
+
+        self.btn_resolve = QPushButton("Move Checked to Trash")
+        self.btn_resolve.setFixedHeight(40)
+        self.btn_resolve.clicked.connect(self.resolve)
+        layout.addWidget(self.btn_resolve)
+
+    def resolve(self):
+        failed = []
+        for row in range(self.list.count()):
+            item = self.list.item(row)
+            path = item.data(Qt.ItemDataRole.UserRole)
+            if not path or item.checkState() != Qt.CheckState.Checked:
+                continue
+            if QFile.moveToTrash(path)[0]:
+                self.removed.append(path)
+            else:
+                failed.append(path)
+        if failed:
+            QMessageBox.warning(self, "Warning", "Could not move to trash:\n" + "\n".join(failed))
+        self.accept()
+
+class HistoryDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Play History")
+        self.resize(600, 500)
+        self.setStyleSheet(parent.styleSheet())
+        self.engine = parent.engine
+        self.settings = parent.settings
+
+        layout = QVBoxLayout(self)
+        self.combo_view = QComboBox()
+        for key, label in HISTORY_VIEWS.items():
+            self.combo_view.addItem(label, key)
+        self.combo_view.setCurrentIndex(max(0, self.combo_view.findData(self.settings.value("history_view", "most"))))
+        self.combo_view.currentIndexChanged.connect(self.load)
+        layout.addWidget(self.combo_view)
+        self.list = QListWidget()
+        self.list.itemDoubleClicked.connect(self.play)
+        layout.addWidget(self.list)
+        self.load()
+
+    def load(self):
+        view = self.combo_view.currentData()
+        self.settings.setValue("history_view", view)
+        self.list.clear()
+        self.engine.call("history", lambda rows, v=view: self.show_rows(v, rows), view=view)
+
+    def show_rows(self, view, rows):
+        if view != self.combo_view.currentData():
+            return
+        self.list.clear()
+        if not rows:
+            item = QListWidgetItem("Nothing here yet")
+            item.setFlags(Qt.ItemFlag.NoItemFlags)
+            self.list.addItem(item)
+            return
+        for path, completed, skipped, last_played in rows:
+            name = f"{os.path.basename(os.path.dirname(path))} / {os.path.splitext(os.path.basename(path))[0]}"
+            if view == "most":
+                detail = f"{completed} plays"
+            elif last_played:
+                detail = time.strftime("%Y-%m-%d %H:%M", time.localtime(last_played))
+            else:
+                detail = ""
+            item = QListWidgetItem(f"{name}    {detail}" if detail else name)
+            item.setData(Qt.ItemDataRole.UserRole, path)
+            item.setToolTip(f"{path}\n{completed} played, {skipped} skipped")
+            self.list.addItem(item)
+
+    def play(self, item):
+        path = item.data(Qt.ItemDataRole.UserRole)
+        if path:
+            self.engine.call("play", playlist=os.path.dirname(path), path=path)
 
 class LocalMusicPlayer(QMainWindow):
     def __init__(self):
@@ -128,33 +3372,39 @@ class LocalMusicPlayer(QMainWindow):
         self.setWindowTitle("Local Music Player")
         self.setFixedSize(900, 700)
         
-        self.root_folder = self.settings.value("root_folder", "")
+        self.engine = EngineClient()
+        self.engine.connected.connect(self.on_engine_connected)
+        self.engine.engine_event.connect(self.on_engine_event)
+        self.index = LibraryIndex()
+        memory_budget.set_limit(self.settings.value("memory_budget_mb", MEMORY_BUDGET_MB, type=int) << 20)
+        self.icons = BudgetCache("thumbnails")
+        self.covers = BudgetCache("covers")
+        self.cover_times = []
+        self.library = {"roots": [], "online": [], "playlists": []}
+        self.restore_playlist = self.settings.value("last_playlist", "")
+        self.loaded_playlist = ""
+        self.pending_reload = False
+        self.normalize_volume = True
+        self.last_interaction = 0.0
         self.playlist_files = [] 
-        self.is_shuffled = False
-        self.is_looping = False
+        self.queue_playlist = ""
+        self.current_index = -1
+        self.current_file = ""
+        self.playback = "stopped"
         self.slider_pressed = False
-        
-        self.player = QMediaPlayer()
-        self.audio_output = QAudioOutput()
-        self.player.setAudioOutput(self.audio_output)
-        
-        self.player.mediaStatusChanged.connect(self.on_media_status_changed)
-        self.player.positionChanged.connect(self.update_slider_position)
-        self.player.durationChanged.connect(self.update_duration)
 
         self.default_icon = self.style().standardIcon(QStyle.StandardPixmap.SP_DriveCDIcon)
 
         self.init_ui()
         self.apply_theme()
         
-        if self.root_folder and os.path.exists(self.root_folder):
-            self.btn_select_folder.setText(f"📁 {os.path.basename(self.root_folder)}")
-            self.refresh_playlists()
-            last_playlist = self.settings.value("last_playlist", "")
-            index = self.combo_playlist.findText(last_playlist)
-            if index >= 0:
-                self.combo_playlist.setCurrentIndex(index)
-                self.load_songs_from_playlist()
+        self.update_folder_button()
+        QApplication.instance().installEventFilter(self)
+        self.engine.start()
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.setInterval(METRICS_REPORT_MS)
+        self.metrics_timer.timeout.connect(self.report_metrics)
+        self.metrics_timer.start()
 
     def init_ui(self):
         self.central_widget = QWidget() 
@@ -173,7 +3423,9 @@ class LocalMusicPlayer(QMainWindow):
         self.btn_select_folder = QPushButton("📁 Select Folder")
         self.btn_select_folder.setFixedWidth(150)
         self.btn_select_folder.setCursor(Qt.CursorShape.PointingHandCursor)
-        self.btn_select_folder.clicked.connect(self.select_root_folder)
+        self.folder_menu = QMenu(self)
+        self.folder_menu.aboutToShow.connect(self.build_folder_menu)
+        self.btn_select_folder.setMenu(self.folder_menu)
         
         self.combo_playlist = QComboBox()
         self.combo_playlist.setPlaceholderText("Select Playlist")
@@ -190,11 +3442,29 @@ class LocalMusicPlayer(QMainWindow):
         self.btn_refresh.setCursor(Qt.CursorShape.PointingHandCursor)
         self.btn_refresh.clicked.connect(self.refresh_playlists)
 
+        self.btn_tools = QPushButton("☰")
+        self.btn_tools.setFixedSize(40, 40)
+        self.btn_tools.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.tools_menu = QMenu(self)
+        self.btn_tools.setMenu(self.tools_menu)
+        self.tools_menu.addAction("Analyze Loudness").triggered.connect(self.analyze_library_loudness)
+        self.tools_menu.addAction("Find Duplicates").triggered.connect(self.find_duplicates)
+        self.tools_menu.addAction("Import Folder...").triggered.connect(self.import_folder)
+        self.tools_menu.addAction("Sync to Device...").triggered.connect(self.sync_to_device)
+        self.tools_menu.addAction("Edit Tags...").triggered.connect(self.edit_tags)
+        self.tools_menu.addAction("Play History...").triggered.connect(self.show_history)
+        self.tools_menu.addAction("Memory Usage").triggered.connect(self.show_memory_usage)
+        self.act_normalize = self.tools_menu.addAction("Normalize Volume")
+        self.act_normalize.setCheckable(True)
+        self.act_normalize.setChecked(self.normalize_volume)
+        self.act_normalize.toggled.connect(self.toggle_normalize)
+
         top_layout.addWidget(self.btn_select_folder)
         top_layout.addStretch() 
         top_layout.addWidget(self.combo_playlist)
         top_layout.addWidget(self.btn_download_popup)
         top_layout.addWidget(self.btn_refresh)
+        top_layout.addWidget(self.btn_tools)
         self.main_layout.addWidget(top_widget)
 
         middle_widget = QWidget()
@@ -224,6 +3494,7 @@ class LocalMusicPlayer(QMainWindow):
         self.song_list = QListWidget()
         self.song_list.setIconSize(QSize(40, 40)) 
         self.song_list.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.song_list.setSelectionMode(QListWidget.SelectionMode.ExtendedSelection)
         self.song_list.itemDoubleClicked.connect(self.play_selected_song)
 
         middle_layout.addWidget(left_panel, 1)
@@ -244,7 +3515,6 @@ class LocalMusicPlayer(QMainWindow):
         self.vol_slider.setRange(0, 100)
         self.vol_slider.setValue(70)
         self.vol_slider.valueChanged.connect(self.set_volume)
-        self.audio_output.setVolume(0.7)
 
         self.btn_prev = QPushButton("⏮")
         self.btn_play = QPushButton("▶") 
@@ -286,7 +3556,8 @@ class LocalMusicPlayer(QMainWindow):
         self.lbl_total_time = QLabel("00:00")
         self.lbl_total_time.setStyleSheet("color: #b9bbbe; background: transparent;")
         
-        self.seek_slider = QSlider(Qt.Orientation.Horizontal)
+        self.seek_slider = WaveformSlider(Qt.Orientation.Horizontal)
+        self.seek_slider.setFixedHeight(36)
         self.seek_slider.setRange(0, 0)
         self.seek_slider.sliderPressed.connect(self.on_slider_pressed)
         self.seek_slider.sliderReleased.connect(self.on_slider_released)
@@ -328,6 +3599,10 @@ class LocalMusicPlayer(QMainWindow):
         QLineEdit { background-color: #202225; border: 1px solid #202225; border-radius: 4px; padding: 5px; color: white; }
         QComboBox { background-color: #202225; border: 1px solid #202225; border-radius: 4px; padding: 5px; color: #dcddde; }
         QComboBox::drop-down { border: 0px; }
+        QMenu { background-color: #2f3136; border: 1px solid #202225; padding: 4px; }
+        QMenu::item { padding: 6px 20px; }
+        QMenu::item:selected { background-color: #40444b; }
+        QStatusBar { background-color: #202225; color: #b9bbbe; font-size: 12px; }
         
         #CoverArt { background-color: #202225; border-radius: 8px; border: 2px solid #2f3136; font-size: 60px; color: #4f545c; }
         #SongTitle { font-size: 18px; font-weight: bold; color: #ffffff; margin-top: 15px; }
@@ -343,77 +3618,189 @@ class LocalMusicPlayer(QMainWindow):
         QSlider::handle:horizontal { background: #ffffff; width: 14px; height: 14px; margin: -3px 0; border-radius: 7px; }
         """
         self.setStyleSheet(style_sheet)
+        self.statusBar().setSizeGripEnabled(False)
+
+    def changeEvent(self, event):
+        if event.type() == QEvent.Type.WindowStateChange and self.isMinimized():
+            memory_budget.trim()
+            self.engine.call("trim_memory")
+        super().changeEvent(event)
 
     def closeEvent(self, event):
-        self.settings.setValue("root_folder", self.root_folder)
-        self.settings.setValue("last_playlist", self.combo_playlist.currentText())
+        self.settings.setValue("last_playlist", self.current_playlist_path())
+        self.engine.call("stop")
+        self.engine.close()
         event.accept()
 
+    def eventFilter(self, obj, event):
+        if event.type() in USER_INPUT_EVENTS:
+            now = time.monotonic()
+            if (now - self.last_interaction) * 1000 >= INTERACTION_NOTIFY_MS:
+                self.last_interaction = now
+                self.engine.call("interaction")
+        return False
+
+    def on_engine_connected(self):
+        self.engine.call("state", self.apply_state)
+
+    def report_metrics(self):
+        caches = {name: stats for name, stats in memory_budget.report()["caches"].items()
+                  if name in (self.icons.name, self.covers.name)}
+        self.engine.call("report_metrics", caches=caches, covers=self.cover_times)
+        self.cover_times = []
+
+    def on_engine_event(self, name, args):
+        handler = getattr(self, "on_engine_" + name, None)
+        if handler is not None:
+            handler(*args)
+
+    def apply_state(self, state):
+        self.on_engine_settings(state["settings"])
+        self.on_engine_library(state["library"])
+        if self.restore_playlist:
+            index = self.combo_playlist.findData(self.restore_playlist)
+            if index < 0:
+                index = self.combo_playlist.findText(self.restore_playlist)
+            if index >= 0:
+                self.combo_playlist.setCurrentIndex(index)
+            self.restore_playlist = ""
+        if state["track"]["file"]:
+            self.on_engine_track(state["track"])
+        self.on_engine_playback(state["playback"])
+        self.update_duration(state["duration"])
+        self.update_slider_position(state["position"])
+        path = self.current_playlist_path()
+        if path and path != self.loaded_playlist:
+            self.load_songs_from_playlist()
+
+    def on_engine_settings(self, settings):
+        for widget in (self.vol_slider, self.btn_shuffle, self.btn_loop, self.act_normalize):
+            widget.blockSignals(True)
+        self.vol_slider.setValue(settings["volume"])
+        self.lbl_vol_icon.setText("🔇" if settings["volume"] == 0 else "🔊")
+        self.btn_shuffle.setChecked(settings["shuffle"])
+        self.btn_loop.setChecked(settings["loop"])
+        self.normalize_volume = settings["normalize"]
+        self.act_normalize.setChecked(self.normalize_volume)
+        for widget in (self.vol_slider, self.btn_shuffle, self.btn_loop, self.act_normalize):
+            widget.blockSignals(False)
+
+    def on_engine_library(self, library):
+        self.library = library
+        self.update_folder_button()
+        self.rebuild_playlist_combo()
+        root = library.get("changed", "")
+        if root and root not in library["roots"] and os.path.dirname(self.loaded_playlist) == root:
+            self.song_list.clear()
+            self.playlist_files = []
+            self.loaded_playlist = ""
+        path = self.current_playlist_path()
+        if not path or os.path.dirname(path) not in library["online"]:
+            return
+        if path != self.loaded_playlist or (self.pending_reload and os.path.dirname(path) == root):
+            self.pending_reload = False
+            self.load_songs_from_playlist()
+
+    def on_engine_status(self, message, timeout):
+        self.statusBar().showMessage(message, timeout)
+
+    def on_engine_download_finished(self, job_id, folder, new_files):
+        if folder == self.loaded_playlist:
+            self.load_songs_from_playlist()
+
     def open_download_dialog(self):
-        if not self.root_folder or not self.combo_playlist.currentText():
+        if not self.current_playlist_path():
              QMessageBox.warning(self, "Warning", "Please select a folder and playlist first.")
              return
         dialog = DownloadDialog(self)
         dialog.exec()
 
+    def current_playlist_path(self):
+        return self.combo_playlist.currentData() or ""
+
+    def update_folder_button(self):
+        roots = self.library["roots"]
+        if not roots:
+            self.btn_select_folder.setText("📁 Select Folder")
+        elif len(roots) == 1:
+            self.btn_select_folder.setText(f"📁 {os.path.basename(roots[0])}")
+        else:
+            self.btn_select_folder.setText(f"📁 {len(roots)} Folders")
+
+    def build_folder_menu(self):
+        self.folder_menu.clear()
+        self.folder_menu.addAction("Add Folder...").triggered.connect(self.select_root_folder)
+        if self.library["roots"]:
+            self.folder_menu.addSeparator()
+        for root in self.library["roots"]:
+            status = "" if root in self.library["online"] else "  (offline)"
+            action = self.folder_menu.addAction(f"✖ {root}{status}")
+            action.triggered.connect(lambda checked=False, r=root: self.engine.call("remove_root", path=r))
+
     def select_root_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "Select Root Folder")
         if folder:
-            self.root_folder = folder
-            self.btn_select_folder.setText(f"📁 {os.path.basename(folder)}")
-            self.refresh_playlists()
+            self.engine.call("add_root", path=folder)
 
-    def refresh_playlists(self):
-        if not self.root_folder: return
-        current = self.combo_playlist.currentText()
+    def rebuild_playlist_combo(self):
+        current = self.current_playlist_path()
         self.combo_playlist.clear()
-        try:
-            items = [d for d in os.listdir(self.root_folder) if os.path.isdir(os.path.join(self.root_folder, d))]
-            items.sort()
-            self.combo_playlist.addItems(items)
-            idx = self.combo_playlist.findText(current)
-            if idx >= 0: self.combo_playlist.setCurrentIndex(idx)
-            self.load_songs_from_playlist() 
-        except: pass
+        multi = len(self.library["roots"]) > 1
+        for root, name in self.library["playlists"]:
+            label = f"{name} ({os.path.basename(root)})" if multi else name
+            self.combo_playlist.addItem(label, os.path.join(root, name))
+        idx = self.combo_playlist.findData(current)
+        if idx >= 0: self.combo_playlist.setCurrentIndex(idx)
+
+    def refresh_playlists(self):
+        if not self.library["roots"]: return
+        self.pending_reload = True
+        self.engine.call("rescan")
 
     def load_songs_from_playlist(self):
-        folder_name = self.combo_playlist.currentText()
-        if not folder_name: return
-        
-        path = os.path.join(self.root_folder, folder_name)
+        path = self.current_playlist_path()
+        if not path: return
+        self.engine.call("tracks", lambda result, p=path: self.show_tracks(p, result), playlist=path)
+
+    def show_tracks(self, path, result):
+        if path != self.current_playlist_path():
+            return
         self.song_list.clear()
         self.playlist_files = []
-        
-        try:
-            files = [f for f in os.listdir(path) if f.lower().endswith(".mp3")]
-            
-            files.sort(key=lambda x: os.path.getmtime(os.path.join(path, x)))
-
-            for f in files:
-                full_path = os.path.join(path, f)
-                self.playlist_files.append(full_path)
-                
-                display_name = os.path.splitext(f)[0]
-                item = QListWidgetItem(display_name)
-                
-                QApplication.processEvents() 
-                try:
-                    audio = MP3(full_path, ID3=ID3)
-                    has_image = False
-                    for key in audio.tags.keys():
-                        if key.startswith('APIC'):
-                            pix = get_scaled_cover(audio.tags[key].data, 40, 40)
-                            if pix:
-                                item.setIcon(QIcon(pix))
-                                has_image = True
-                            break
-                    if not has_image:
-                        item.setIcon(self.default_icon)
-                except:
-                    item.setIcon(self.default_icon)
-
-                self.song_list.addItem(item)
-        except: pass
+        self.loaded_playlist = ""
+
+        if result["offline"]:
+            item = QListWidgetItem("⏳ Library folder is not responding")
+            item.setFlags(Qt.ItemFlag.NoItemFlags)
+            self.song_list.addItem(item)
+            return
+
+        self.loaded_playlist = path
+        cached = self.index.folder_entries(path)
+        for full_path in result["tracks"]:
+            self.playlist_files.append(full_path)
+            item = QListWidgetItem(os.path.splitext(os.path.basename(full_path))[0])
+            entry = cached.get(full_path)
+            item.setIcon(self.thumbnail_icon(full_path, entry))
+            if entry:
+                item.setToolTip(" - ".join(part for part in (entry[4], entry[3]) if part))
+            self.song_list.addItem(item)
+        if self.queue_playlist == path and self.current_file in self.playlist_files:
+            self.song_list.setCurrentRow(self.playlist_files.index(self.current_file))
+
+    def thumbnail_icon(self, path, entry):
+        if not entry or not entry[2]:
+            return self.default_icon
+        icon = self.icons.get((path, entry[1]))
+        if icon is None:
+            started = time.monotonic()
+            pix = QPixmap()
+            if not pix.loadFromData(entry[2]):
+                return self.default_icon
+            icon = QIcon(pix)
+            self.icons.put((path, entry[1]), icon, pix.width() * pix.height() * pix.depth() // 8,
+                           time.monotonic() - started)
+        return icon
 
     def play_selected_song(self):
         row = self.song_list.currentRow()
@@ -422,74 +3809,136 @@ class LocalMusicPlayer(QMainWindow):
 
     def play_file(self, index):
         if 0 <= index < len(self.playlist_files):
-            file_path = self.playlist_files[index]
-            self.player.setSource(QUrl.fromLocalFile(file_path))
-            self.player.play()
-            
-            self.song_list.setCurrentRow(index)
-            self.btn_play.setText("⏸") 
-            
-            clean_name = os.path.splitext(os.path.basename(file_path))[0]
-            self.lbl_song_name.setText(clean_name)
-            
-            self.update_cover_art(file_path)
+            self.engine.call("play", playlist=self.loaded_playlist, path=self.playlist_files[index])
+
+    def on_engine_track(self, track):
+        self.queue_playlist = track["playlist"]
+        self.current_index = track["index"]
+        self.current_file = file_path = track["file"]
+        if self.queue_playlist == self.loaded_playlist and file_path in self.playlist_files:
+            self.song_list.setCurrentRow(self.playlist_files.index(file_path))
+        
+        clean_name = os.path.splitext(os.path.basename(file_path))[0]
+        self.lbl_song_name.setText(clean_name)
+        
+        self.update_waveform(file_path)
+        self.update_cover_art(file_path)
+
+    def on_engine_playback(self, state):
+        self.playback = state
+        self.btn_play.setText("⏸" if state == "playing" else "▶")
+
+    def update_waveform(self, file_path):
+        self.seek_slider.set_peaks(load_peaks(self.index, file_path))
+
+    def on_engine_waveform_ready(self, path):
+        if path == self.current_file:
+            self.seek_slider.set_peaks(load_peaks(self.index, path))
 
     def update_cover_art(self, file_path):
         self.lbl_cover.setText("🎵")
         self.lbl_cover.setPixmap(QPixmap())
         try:
-            audio = MP3(file_path, ID3=ID3)
-            for key in audio.tags.keys():
-                if key.startswith('APIC'):
-                    pix = get_scaled_cover(audio.tags[key].data, 320, 320)
-                    if pix:
-                        self.lbl_cover.setPixmap(pix)
-                    break
-        except Exception as e:
-            pass
+            key = (file_path, os.path.getmtime(file_path))
+        except OSError:
+            return
+        pix = self.covers.get(key)
+        if pix is None:
+            started = time.monotonic()
+            pix = QPixmap()
+            try:
+                audio = MP3(file_path, ID3=ID3)
+                for tag in audio.tags.keys():
+                    if tag.startswith('APIC'):
+                        pix = get_scaled_cover(audio.tags[tag].data, COVER_SIZE, COVER_SIZE) or QPixmap()
+                        break
+            except Exception as e:
+                pass
+            self.cover_times.append(time.monotonic() - started)
+            self.covers.put(key, pix, pix.width() * pix.height() * pix.depth() // 8, time.monotonic() - started)
+        if not pix.isNull():
+            self.lbl_cover.setPixmap(pix)
 
     def play_pause(self):
-        if self.player.playbackState() == QMediaPlayer.PlaybackState.PlayingState:
-            self.player.pause()
-            self.btn_play.setText("▶")
-        else:
-            if self.playlist_files:
-                if self.player.playbackState() == QMediaPlayer.PlaybackState.StoppedState:
-                    self.play_selected_song()
-                else:
-                    self.player.play()
-                    self.btn_play.setText("⏸")
+        if self.playback == "playing":
+            self.engine.call("pause")
+        elif self.playback == "paused":
+            self.engine.call("resume")
+        elif self.playlist_files:
+            self.play_selected_song()
 
-    def next_song(self):
-        count = len(self.playlist_files)
-        if count == 0: return
-        current_row = self.song_list.currentRow()
-        if self.is_shuffled:
-            next_idx = random.randint(0, count - 1)
-        else:
-            next_idx = (current_row + 1) % count
-        self.play_file(next_idx)
-
-    def prev_song(self):
-        count = len(self.playlist_files)
-        if count == 0: return
-        current_row = self.song_list.currentRow()
-        prev_idx = (current_row - 1) % count
-        self.play_file(prev_idx)
-
-    def toggle_shuffle(self): self.is_shuffled = self.btn_shuffle.isChecked()
-    def toggle_loop(self): self.is_looping = self.btn_loop.isChecked()
+    def next_song(self): self.engine.call("next")
+    def prev_song(self): self.engine.call("prev")
+
+    def toggle_shuffle(self): self.engine.call("set_shuffle", enabled=self.btn_shuffle.isChecked())
+    def toggle_loop(self): self.engine.call("set_loop", enabled=self.btn_loop.isChecked())
     def set_volume(self, value):
-        self.audio_output.setVolume(value / 100)
+        self.engine.call("set_volume", value=value)
         self.lbl_vol_icon.setText("🔇" if value == 0 else "🔊")
 
-    def on_media_status_changed(self, status):
-        if status == QMediaPlayer.MediaStatus.EndOfMedia:
-            if self.is_looping:
-                self.player.setPosition(0)
-                self.player.play()
-            else:
-                self.next_song()
+    def toggle_normalize(self, checked):
+        self.engine.call("set_normalize", enabled=checked)
+
+    def analyze_library_loudness(self):
+        self.engine.call("analyze_loudness")
+
+    def find_duplicates(self):
+        self.engine.call("find_duplicates")
+
+    def import_folder(self):
+        playlist = self.current_playlist_path()
+        if not playlist:
+            QMessageBox.warning(self, "Warning", "Please select a folder and playlist first.")
+            return
+        source = QFileDialog.getExistingDirectory(self, "Select Folder to Import")
+        if source:
+            self.engine.call("import", source=source, playlist=playlist)
+
+    def edit_tags(self):
+        rows = sorted(self.song_list.row(item) for item in self.song_list.selectedItems())
+        paths = [self.playlist_files[row] for row in rows] if rows else list(self.playlist_files)
+        if not paths:
+            QMessageBox.warning(self, "Warning", "Please select a playlist first.")
+            return
+        TagEditorDialog(paths, self).exec()
+
+    def on_engine_tags_updated(self, rows):
+        for path, title, artist in rows:
+            if path in self.playlist_files:
+                item = self.song_list.item(self.playlist_files.index(path))
+                item.setToolTip(" - ".join(part for part in (artist, title) if part))
+
+    def show_memory_usage(self):
+        window = memory_budget.report()
+        self.engine.call("memory", lambda engine: QMessageBox.information(
+            self, "Memory Usage", "Window\n" + format_memory_report(window) +
+            "\n\nPlayer service\n" + format_memory_report(engine)))
+
+    def sync_to_device(self):
+        SyncDialog(self).exec()
+
+    def show_history(self):
+        HistoryDialog(self).exec()
+
+    def on_engine_imported(self, playlist, files):
+        if playlist == self.loaded_playlist:
+            self.load_songs_from_playlist()
+
+    def on_engine_duplicates(self, groups):
+        if not groups:
+            self.statusBar().showMessage("Duplicates: none found", 10000)
+            return
+        self.statusBar().clearMessage()
+        dialog = DuplicatesDialog(groups, self)
+        dialog.exec()
+        if any(os.path.dirname(p) == self.loaded_playlist for p in dialog.removed):
+            self.load_songs_from_playlist()
+
+    def on_engine_position(self, position):
+        self.update_slider_position(position)
+
+    def on_engine_duration(self, duration):
+        self.update_duration(duration)
 
     def update_duration(self, duration):
         self.seek_slider.setRange(0, duration)
@@ -503,7 +3952,7 @@ class LocalMusicPlayer(QMainWindow):
     def on_slider_pressed(self): self.slider_pressed = True
     def on_slider_released(self):
         self.slider_pressed = False
-        self.player.setPosition(self.seek_slider.value())
+        self.engine.call("seek", position=self.seek_slider.value())
     def on_slider_moved(self, position): self.lbl_current_time.setText(self.format_time(position))
     def format_time(self, ms):
         seconds = (ms // 1000) % 60
@@ -511,6 +3960,10 @@ class LocalMusicPlayer(QMainWindow):
         return f"{minutes:02}:{seconds:02}"
 
 if __name__ == "__main__":
+    if "--daemon" in sys.argv[1:]:
+        sys.exit(run_daemon())
+    if sys.argv[1:2] == ["--ctl"]:
+        sys.exit(run_ctl(sys.argv[2:]))
     app = QApplication(sys.argv)
     window = LocalMusicPlayer()
     window.show()
@@ -0,0 +1,291 @@
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+from PyQt6.QtCore import QTimer, QSettings, QBuffer, QIODevice
+from PyQt6.QtGui import QImage, QColor
+from PyQt6.QtWidgets import QApplication
+from mutagen.id3 import ID3, APIC, TIT2, TPE1
+
+import localmusic
+
+SILENT_FRAME = b"\xff\xfb\x90\xc4" + bytes(413)
+FRAMES_PER_SECOND = 38
+TRACK_SECONDS = 2
+COVER_PIXELS = 500
+OPERATION_TIMEOUT = 10.0
+RELOAD_EVERY = 25
+REFRESH_EVERY = 100
+
+def isolate_environment():
+    home = tempfile.mkdtemp(prefix="localmusic-soak-")
+    for variable in ("HOME", "XDG_CONFIG_HOME", "XDG_CACHE_HOME", "XDG_DATA_HOME", "XDG_RUNTIME_DIR"):
+        os.environ[variable] = os.path.join(home, variable.lower())
+        os.makedirs(os.environ[variable], mode=0o700, exist_ok=True)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    return home
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def median(values):
+    return percentile(values, 0.5)
+
+def make_cover(seed):
+    image = QImage(COVER_PIXELS, COVER_PIXELS, QImage.Format.Format_RGB32)
+    image.fill(QColor.fromHsv(seed * 37 % 360, 160, 200))
+    buffer = QBuffer()
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, "JPG", 85)
+    return bytes(buffer.data())
+
+def write_track(path, seed):
+    with open(path, "wb") as f:
+        f.write(SILENT_FRAME * (FRAMES_PER_SECOND * TRACK_SECONDS))
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text=f"Track {seed}"))
+    tags.add(TPE1(encoding=3, text=f"Artist {seed % 17}"))
+    tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=make_cover(seed)))
+    tags.save(path)
+
+def build_library(root, playlists, tracks):
+    library = {}
+    for p in range(playlists):
+        folder = os.path.join(root, f"Playlist {p:02}")
+        os.makedirs(folder)
+        paths = []
+        for t in range(tracks):
+            path = os.path.join(folder, f"Song {p:02}-{t:03}.mp3")
+            write_track(path, p * tracks + t)
+            paths.append(path)
+        library[folder] = paths
+    return library
+
+class SoakRunner:
+    def __init__(self, app, window, library, args):
+        self.app = app
+        self.window = window
+        self.library = library
+        self.args = args
+        self.operation = 0
+        self.kind = None
+        self.expected = None
+        self.started = 0.0
+        self.rewrites = 0
+        self.latencies = {}
+        self.samples = []
+        self.timeouts = 0
+        self.baseline_snapshot = None
+        self.final_snapshot = None
+        self.show_tracks = window.show_tracks
+        window.show_tracks = self.on_show_tracks
+        window.engine.engine_event.connect(self.on_event)
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.on_timeout)
+
+    def start(self):
+        self.sample()
+        QTimer.singleShot(0, self.next_operation)
+
+    def next_operation(self):
+        if self.operation >= self.args.operations:
+            self.sample()
+            self.app.quit()
+            return
+        if self.operation % self.args.sample_every == 0:
+            self.sample()
+        self.operation += 1
+        folders = list(self.library)
+        folder = folders[(self.operation // RELOAD_EVERY) % len(folders)]
+        if self.operation % REFRESH_EVERY == 0:
+            self.begin("refresh", None)
+            self.window.refresh_playlists()
+        elif self.operation % REFRESH_EVERY == REFRESH_EVERY // 2:
+            folder = self.window.loaded_playlist
+            self.begin("download_reload", folder)
+            path = self.library[folder][self.rewrites % len(self.library[folder])]
+            self.rewrites += 1
+            write_track(path, self.rewrites)
+            self.window.on_engine_download_finished(0, folder, [path])
+        elif folder != self.window.loaded_playlist:
+            self.begin("reload", folder)
+            self.window.combo_playlist.setCurrentIndex(self.window.combo_playlist.findData(folder))
+            self.window.load_songs_from_playlist()
+        else:
+            index = (self.operation * 7) % len(self.window.playlist_files)
+            self.begin("track_switch", self.window.playlist_files[index])
+            self.window.play_file(index)
+
+    def begin(self, kind, expected):
+        self.kind = kind
+        self.expected = expected
+        self.started = time.perf_counter()
+        self.timer.start(int(OPERATION_TIMEOUT * 1000))
+
+    def finish(self):
+        self.timer.stop()
+        elapsed = time.perf_counter() - self.started
+        self.latencies.setdefault(self.kind, []).append((self.operation, elapsed))
+        self.kind = None
+        QTimer.singleShot(0, self.next_operation)
+
+    def on_show_tracks(self, path, result):
+        self.show_tracks(path, result)
+        if self.kind in ("reload", "download_reload") and path == self.expected:
+            self.finish()
+
+    def on_event(self, name, args):
+        if self.kind == "track_switch" and name == "track" and args[0]["file"] == self.expected:
+            self.finish()
+        elif self.kind == "refresh" and name == "library":
+            self.finish()
+
+    def on_timeout(self):
+        self.timeouts += 1
+        print(f"operation {self.operation} ({self.kind}) timed out", file=sys.stderr)
+        self.kind = None
+        QTimer.singleShot(0, self.next_operation)
+
+    def sample(self):
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)])
+        if self.baseline_snapshot is None and self.operation >= self.args.warmup:
+            self.baseline_snapshot = snapshot
+        self.final_snapshot = snapshot
+        self.samples.append({"operation": self.operation, "time": time.monotonic(), "rss": rss_bytes(),
+                             "heap": sum(stat.size for stat in snapshot.statistics("filename")),
+                             "caches": localmusic.memory_budget.total()})
+        sample = self.samples[-1]
+        if self.args.verbose:
+            print(f"{sample['operation']:>7} ops  rss {sample['rss'] / 2**20:7.1f} MB  "
+                  f"heap {sample['heap'] / 2**20:7.1f} MB  caches {sample['caches'] / 2**20:6.1f} MB")
+
+    def report(self):
+        window = max(1, self.args.window)
+        warm = [s for s in self.samples if s["operation"] >= self.args.warmup]
+        first = [s for s in warm if s["operation"] < self.args.warmup + window] or warm[:1]
+        last = [s for s in warm if s["operation"] > self.args.operations - window] or warm[-1:]
+        result = {"operations": self.operation, "timeouts": self.timeouts, "failures": [],
+                  "rss_growth_mb": (median([s["rss"] for s in last]) - median([s["rss"] for s in first])) / 2**20,
+                  "heap_growth_mb": (median([s["heap"] for s in last]) - median([s["heap"] for s in first])) / 2**20,
+                  "latency": {}}
+        if result["rss_growth_mb"] > self.args.max_rss_growth:
+            result["failures"].append(f"RSS grew {result['rss_growth_mb']:.1f} MB "
+                                      f"(limit {self.args.max_rss_growth} MB)")
+        if result["heap_growth_mb"] > self.args.max_heap_growth:
+            result["failures"].append(f"Python heap grew {result['heap_growth_mb']:.1f} MB "
+                                      f"(limit {self.args.max_heap_growth} MB)")
+        if self.timeouts > self.args.max_timeouts:
+            result["failures"].append(f"{self.timeouts} operations timed out")
+        for kind, values in sorted(self.latencies.items()):
+            early = [v for op, v in values if self.args.warmup <= op < self.args.warmup + window]
+            late = [v for op, v in values if op > self.args.operations - window]
+            if not early or not late:
+                continue
+            stats = {"count": len(values), "p50_ms": median([v for op, v in values]) * 1000,
+                     "early_p95_ms": percentile(early, 0.95) * 1000, "late_p95_ms": percentile(late, 0.95) * 1000}
+            result["latency"][kind] = stats
+            limit = stats["early_p95_ms"] * self.args.max_latency_drift + self.args.latency_slack_ms
+            if stats["late_p95_ms"] > limit:
+                result["failures"].append(f"{kind} p95 drifted from {stats['early_p95_ms']:.1f} ms "
+                                          f"to {stats['late_p95_ms']:.1f} ms")
+        if self.baseline_snapshot is not None and self.final_snapshot is not None:
+            result["top_growth"] = [str(stat) for stat in
+                                    self.final_snapshot.compare_to(self.baseline_snapshot, "lineno")[:10]]
+        result["samples"] = self.samples
+        return result
+
+def print_report(result):
+    print(f"{result['operations']} operations, {result['timeouts']} timeouts")
+    print(f"RSS growth {result['rss_growth_mb']:.1f} MB, Python heap growth {result['heap_growth_mb']:.1f} MB")
+    for kind, stats in result["latency"].items():
+        print(f"{kind}: {stats['count']} ops, p50 {stats['p50_ms']:.1f} ms, "
+              f"p95 {stats['early_p95_ms']:.1f} -> {stats['late_p95_ms']:.1f} ms")
+    if result.get("top_growth"):
+        print("Largest allocation growth since warm-up:")
+        for line in result["top_growth"]:
+            print(f"  {line}")
+    for failure in result["failures"]:
+        print(f"FAIL: {failure}")
+    if not result["failures"]:
+        print("PASS")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Headless soak test for Local Music Player.")
+    parser.add_argument("--operations", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=500)
+    parser.add_argument("--window", type=int, default=1000)
+    parser.add_argument("--sample-every", type=int, default=100)
+    parser.add_argument("--playlists", type=int, default=8)
+    parser.add_argument("--tracks", type=int, default=60)
+    parser.add_argument("--max-rss-growth", type=float, default=48.0)
+    parser.add_argument("--max-heap-growth", type=float, default=16.0)
+    parser.add_argument("--max-latency-drift", type=float, default=2.0)
+    parser.add_argument("--latency-slack-ms", type=float, default=5.0)
+    parser.add_argument("--max-timeouts", type=int, default=0)
+    parser.add_argument("--report", help="write the full report with all samples as JSON")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic library and settings")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    home = isolate_environment()
+    tracemalloc.start()
+    app = QApplication(sys.argv[:1])
+    root = os.path.join(home, "library")
+    library = build_library(root, args.playlists, args.tracks)
+    settings = QSettings("LocalMusicPlayer", "Config")
+    settings.setValue("root_folders", [root])
+    settings.setValue("last_playlist", next(iter(library)))
+    settings.setValue("volume", 0)
+    settings.sync()
+
+    engine = localmusic.PlayerEngine()
+    server = localmusic.EngineServer(engine)
+    if not server.listen(localmusic.engine_socket_name()):
+        print("Could not start the soak engine.", file=sys.stderr)
+        return 2
+    window = localmusic.LocalMusicPlayer()
+    runner = SoakRunner(app, window, library, args)
+    def wait_for_library():
+        if window.loaded_playlist:
+            runner.start()
+        else:
+            QTimer.singleShot(100, wait_for_library)
+    QTimer.singleShot(0, wait_for_library)
+    app.exec()
+
+    result = runner.report()
+    print_report(result)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    window.engine.close()
+    if not args.keep:
+        shutil.rmtree(home, ignore_errors=True)
+    else:
+        print(f"Library and settings kept in {home}")
+    return 1 if result["failures"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+home = tempfile.mkdtemp(prefix="localmusic-tests-")
+for variable in ("HOME", "XDG_CONFIG_HOME", "XDG_CACHE_HOME", "XDG_DATA_HOME", "XDG_RUNTIME_DIR"):
+    os.environ[variable] = os.path.join(home, variable.lower())
+    os.makedirs(os.environ[variable], mode=0o700, exist_ok=True)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt6.QtCore import QCoreApplication
+
+@pytest.fixture(scope="session")
+def app():
+    return QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
@@ -0,0 +1,120 @@
+import os
+import threading
+
+import pytest
+
+import localmusic
+
+class FakeExtractor:
+    def __init__(self, playlists, details):
+        self.playlists = playlists
+        self.details = details
+        self.calls = []
+        self.lock = threading.Lock()
+        self.barrier = None
+
+    def __call__(self, url, flat):
+        with self.lock:
+            self.calls.append((url, flat))
+        if flat:
+            return self.playlists[url]
+        if self.barrier is not None:
+            self.barrier.wait()
+        if url not in self.details:
+            raise ValueError(f"Unavailable: {url}")
+        return self.details[url]
+
+def flat_playlist():
+    return {"entries": [
+        {"id": "a", "url": "https://example.com/a", "title": "Song A", "duration": 120},
+        {"id": "b", "url": "https://example.com/b", "title": "", "duration": 90},
+        {"id": "c", "url": "https://example.com/c", "title": "Song C"},
+        {"id": "d", "url": "https://example.com/d"},
+        None,
+    ]}
+
+def details():
+    return {"https://example.com/b": {"id": "b", "title": "Song B", "duration": 91},
+            "https://example.com/c": {"id": "c", "title": "Song C (Live)", "duration": 200},
+            "https://example.com/d": {"id": "d", "title": "Song D", "duration": 60}}
+
+@pytest.fixture
+def extractor():
+    return FakeExtractor({"https://example.com/list": flat_playlist(),
+                          "https://example.com/other": {"id": "x", "title": "Single", "duration": 30}}, details())
+
+def test_missing_fields_are_filled_in_parallel(extractor):
+    extractor.barrier = threading.Barrier(3, timeout=5)
+    entries = localmusic.PlaylistPreviewer(extractor).preview("https://example.com/list")
+    assert [(e["id"], e["title"], e["duration"]) for e in entries] == [
+        ("a", "Song A", 120), ("b", "Song B", 91), ("c", "Song C (Live)", 200), ("d", "Song D", 60)]
+    assert entries[3]["size"] == 60 * localmusic.MP3_BYTES_PER_SECOND
+    assert all(e["url"] == f"https://example.com/{e['id']}" for e in entries)
+    assert sorted(url for url, flat in extractor.calls if not flat) == [
+        "https://example.com/b", "https://example.com/c", "https://example.com/d"]
+
+def test_failed_detail_keeps_flat_entry(extractor):
+    del extractor.details["https://example.com/d"]
+    entries = localmusic.PlaylistPreviewer(extractor).preview("https://example.com/list")
+    assert (entries[3]["title"], entries[3]["duration"], entries[3]["size"]) == ("", None, None)
+
+def test_single_video_is_one_entry(extractor):
+    entries = localmusic.PlaylistPreviewer(extractor).preview("https://example.com/other")
+    assert [(e["id"], e["title"], e["duration"]) for e in entries] == [("x", "Single", 30)]
+
+def test_preview_is_cached_per_url(extractor, monkeypatch):
+    previewer = localmusic.PlaylistPreviewer(extractor)
+    first = previewer.preview("https://example.com/list")
+    extractor.calls.clear()
+    assert previewer.preview("https://example.com/list") == first
+    assert extractor.calls == []
+    previewer.preview("https://example.com/other")
+    assert extractor.calls == [("https://example.com/other", True)]
+    monkeypatch.setattr(localmusic, "PREVIEW_CACHE_SECONDS", 0)
+    extractor.calls.clear()
+    previewer.preview("https://example.com/list")
+    assert ("https://example.com/list", True) in extractor.calls
+
+@pytest.fixture
+def engine(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(localmusic, "download_journal_path", lambda: str(tmp_path / "downloads.json"))
+    engine = localmusic.PlayerEngine()
+    monkeypatch.setattr(engine, "run_in_thread", lambda func, callback: callback(func()))
+    monkeypatch.setattr(engine, "start_next_download", lambda: None)
+    return engine
+
+def test_preview_marks_tracks_in_library(engine, extractor, tmp_path):
+    engine.previewer = localmusic.PlaylistPreviewer(extractor)
+    folder = tmp_path / "Playlist"
+    folder.mkdir()
+    (folder / "song a.mp3").write_bytes(b"")
+    library = tmp_path / "Library"
+    library.mkdir()
+    indexed = library / localmusic.downloaded_name("Song C (Live)")
+    indexed.write_bytes(b"")
+    engine.index.store_many([localmusic.index_entry(str(indexed), os.stat(indexed))])
+    replies = []
+    engine.cmd_preview(replies.append, "https://example.com/list", str(folder))
+    assert replies[0]["error"] is None
+    assert [(e["id"], e["in_library"]) for e in replies[0]["entries"]] == [
+        ("a", True), ("b", False), ("c", True), ("d", False)]
+
+def test_preview_reports_extractor_errors(engine, extractor):
+    engine.previewer = localmusic.PlaylistPreviewer(extractor)
+    replies = []
+    engine.cmd_preview(replies.append, "https://example.com/missing", "")
+    assert replies[0]["entries"] == []
+    assert replies[0]["error"]
+
+def test_download_journals_selected_entries(engine, tmp_path):
+    selected = ["https://example.com/b", "https://example.com/d"]
+    job_id = engine.cmd_download("https://example.com/list", str(tmp_path), True, selected)
+    plain_id = engine.cmd_download("https://example.com/other", str(tmp_path))
+    journal = localmusic.load_download_journal()
+    assert journal["next_id"] == plain_id + 1
+    jobs = {job["id"]: job for job in journal["jobs"]}
+    assert jobs[job_id]["entries"] == selected
+    assert jobs[job_id]["is_playlist"] is True
+    assert jobs[plain_id]["entries"] is None
+    selected.append("https://example.com/a")
+    assert localmusic.load_download_journal()["jobs"][0]["entries"] == selected[:2]